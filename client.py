@@ -4,8 +4,14 @@ Client for messenger with chat, tasks, and AI
 Features: registration, authentication, chat, task management, AI chat
 """
 
+import argparse
+import getpass
+import json
+import os
 import socket
 import sys
+import threading
+import time
 
 
 def recv_until_end(sock, timeout=5):
@@ -24,6 +30,24 @@ def recv_until_end(sock, timeout=5):
         return ""
 
 
+def recv_line(sock, timeout=5):
+    """Receive one line without reading past it (raw data may follow)"""
+    old_timeout = sock.gettimeout()
+    sock.settimeout(timeout)
+    data = b''
+    try:
+        while not data.endswith(b'\n'):
+            byte = sock.recv(1)
+            if not byte:
+                break
+            data += byte
+    except socket.timeout:
+        pass
+    finally:
+        sock.settimeout(old_timeout)
+    return data.decode('utf-8', errors='ignore').strip()
+
+
 def send_command(sock, command):
     """Send command and receive response"""
     sock.send(command.encode('utf-8') + b'\n')
@@ -58,9 +82,10 @@ def show_menu():
 1. Chat
 2. Tasks
 3. AI Chat
-4. Help
-5. Logout
-6. Exit
+4. Files
+5. Help
+6. Logout
+7. Exit
 ========================================
 """)
 
@@ -71,7 +96,10 @@ def chat_menu(sock):
         print("\n-- CHAT --")
         print("1. Send message")
         print("2. View messages")
-        print("3. Back")
+        print("3. List channels")
+        print("4. Join channel")
+        print("5. Leave channel")
+        print("6. Back")
         choice = input("Choice: ").strip()
         
         if choice == '1':
@@ -85,6 +113,18 @@ def chat_menu(sock):
             response = send_command(sock, f'chat view {count}')
             print(response)
         elif choice == '3':
+            response = send_command(sock, 'chat channels')
+            print(response)
+        elif choice == '4':
+            channel = input("Channel (becomes current for send/view): ").strip()
+            if channel:
+                response = send_command(sock, f'chat join {channel}')
+                print(response)
+        elif choice == '5':
+            channel = input("Channel (empty = current): ").strip()
+            response = send_command(sock, f'chat leave {channel}'.strip())
+            print(response)
+        elif choice == '6':
             break
 
 
@@ -142,6 +182,71 @@ def task_menu(sock):
             break
 
 
+def upload_file(sock, path, name):
+    """Upload a local file; the server answers '[OK] Send <n> bytes' first"""
+    size = os.path.getsize(path)
+    sock.send(f'file upload {name} {size}\n'.encode('utf-8'))
+    header = recv_line(sock)
+    if not header.startswith('[OK]'):
+        return header
+    with open(path, 'rb') as f:
+        sock.sendfile(f)
+    return recv_until_end(sock, timeout=30)
+
+
+def download_file(sock, name, path):
+    """Download a file; the server answers '[OK] <n> bytes, sha256 <hash>' then raw bytes"""
+    sock.send(f'file download {name}\n'.encode('utf-8'))
+    header = recv_line(sock)
+    if not header.startswith('[OK]'):
+        return header
+    remaining = int(header.split()[1])
+    with open(path, 'wb') as f:
+        while remaining > 0:
+            chunk = sock.recv(min(remaining, 65536))
+            if not chunk:
+                return "[ERR] Connection closed during download"
+            f.write(chunk)
+            remaining -= len(chunk)
+    return f"{header}\nSaved to {path}"
+
+
+def file_menu(sock):
+    """Files submenu"""
+    while True:
+        print("\n-- FILES --")
+        print("1. List files")
+        print("2. Upload file")
+        print("3. Download file")
+        print("4. Delete file")
+        print("5. Back")
+        choice = input("Choice: ").strip()
+        
+        if choice == '1':
+            response = send_command(sock, 'file list')
+            print(response)
+        elif choice == '2':
+            path = input("Local path: ").strip()
+            if path:
+                if not os.path.isfile(path):
+                    print("[ERR] File not found")
+                    continue
+                name = input(f"Name on server (default {os.path.basename(path)}): ").strip()
+                print(upload_file(sock, path, name or os.path.basename(path)))
+        elif choice == '3':
+            name = input("File name: ").strip()
+            if name:
+                path = input(f"Save as (default {name}): ").strip()
+                print(download_file(sock, name, path or name))
+        elif choice == '4':
+            name = input("File name: ").strip()
+            if name:
+                response = send_command(sock, f'file delete {name}')
+                print(response)
+        elif choice == '5':
+            break
+
+
 def ai_menu(sock):
     """AI Chat submenu"""
     while True:
@@ -195,21 +300,222 @@ def auth_menu(sock):
     return False
 
 
+def is_block_start(line):
+    """True for commands that read following lines until END"""
+    words = line.split()
+    if not words:
+        return False
+    if words[0].lower() == 'batch' and len(words) == 1:
+        return True
+    return (len(words) >= 2 and words[0].lower() == 'task'
+            and words[1].lower() in ('add-desc', 'add-sol', 'append-desc', 'append-sol'))
+
+
+def split_blocks(lines):
+    """
+    Group script lines into blocks: a single command, or a multiline
+    command together with its lines up to END. Blank lines and # comments
+    outside multiline blocks are skipped.
+    """
+    blocks = []
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if current is not None:
+            current.append(line)
+            if line == 'END':
+                blocks.append(current)
+                current = None
+        elif not line.strip() or line.lstrip().startswith('#'):
+            continue
+        elif is_block_start(line):
+            current = [line]
+        else:
+            blocks.append([line])
+    if current is not None:
+        current.append('END')
+        blocks.append(current)
+    return blocks
+
+
+RATE_LIMIT_REPLY = "[ERR] Rate limit exceeded"
+
+
+def count_errors(line, counts):
+    """Count [ERR] replies in a response line, including command outputs of a JSON batch reply"""
+    if line.startswith('[{'):
+        try:
+            outputs = [r['output'] for r in json.loads(line)]
+        except (ValueError, TypeError, KeyError):
+            outputs = []
+        for output in outputs:
+            for out_line in output.splitlines():
+                count_errors(out_line, counts)
+    elif line.startswith('[ERR]'):
+        counts['errors'] += 1
+        if line.startswith(RATE_LIMIT_REPLY):
+            counts['rate_limited'] += 1
+
+
+def run_script_connection(host, port, auth, blocks, label, results):
+    """
+    Authenticate once with the `auth` command (login or resume), then pipeline all blocks over one connection and
+    stream the responses to stdout. Stores (commands, seconds, error, counts of [ERR] replies) in results[label].
+    """
+    started = time.monotonic()
+    counts = {'errors': 0, 'rate_limited': 0}
+    try:
+        sock = socket.create_connection((host, port))
+    except OSError as e:
+        results[label] = (0, 0.0, f"cannot connect: {e}", counts)
+        return
+    
+    prefix = f"[{label}] " if label is not None else ""
+    responses = sock.makefile('rb')
+    
+    def echo(raw):
+        line = raw.decode('utf-8', errors='replace')
+        sys.stdout.write(prefix + line)
+        return line
+    
+    try:
+        # Nothing is sent before the server accepts the credentials
+        sock.sendall((auth + '\n').encode('utf-8'))
+        while True:
+            raw = responses.readline()
+            if not raw:
+                raise ConnectionResetError("connection closed during authentication")
+            line = echo(raw)
+            if line.startswith('[OK]'):
+                break
+            if line.startswith('[ERR]') or line.startswith('Usage:'):
+                sys.stdout.flush()
+                results[label] = (0, time.monotonic() - started, f"authentication failed: {line.strip()}", counts)
+                sock.close()
+                return
+    except OSError as e:
+        sys.stdout.flush()
+        results[label] = (0, time.monotonic() - started, str(e), counts)
+        sock.close()
+        return
+    
+    def reader():
+        for raw in responses:
+            count_errors(echo(raw), counts)
+        sys.stdout.flush()
+    
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    
+    # Commands are written back to back; the server answers them in order
+    payload = []
+    for block in blocks:
+        payload.extend(block)
+    payload.append("quit")
+    try:
+        sock.sendall(('\n'.join(payload) + '\n').encode('utf-8'))
+        reader_thread.join()
+        error = None
+    except OSError as e:
+        error = str(e)
+    finally:
+        sock.close()
+    
+    results[label] = (len(blocks), time.monotonic() - started, error, counts)
+
+
+def run_script(host, port, args):
+    """Non-interactive mode: execute a command script (or stdin)"""
+    if args.exec == '-':
+        lines = sys.stdin.readlines()
+    else:
+        try:
+            with open(args.exec, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError as e:
+            print(f"[ERR] Cannot read script: {e}", file=sys.stderr)
+            sys.exit(1)
+    
+    if args.token:
+        # Reuses the session of an earlier login, no password check on the server
+        auth = f"resume {args.token}"
+    elif args.user:
+        password = args.password
+        if password is None:
+            password = getpass.getpass(f"Password for {args.user}: ")
+        auth = f"login {args.user} {password}"
+    else:
+        print("[ERR] --user or --token is required with --exec", file=sys.stderr)
+        sys.exit(1)
+    
+    blocks = split_blocks(lines)
+    parallel = max(1, min(args.parallel, len(blocks) or 1))
+    
+    # Blocks are dealt round-robin, so each connection keeps its own order
+    shares = [blocks[i::parallel] for i in range(parallel)]
+    results = {}
+    started = time.monotonic()
+    threads = []
+    for i, share in enumerate(shares):
+        label = i + 1 if parallel > 1 else None
+        thread = threading.Thread(target=run_script_connection,
+                                  args=(host, port, auth, share, label, results))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    
+    failed = False
+    errors = rate_limited = 0
+    for label, (count, seconds, error, counts) in sorted(results.items(), key=lambda r: r[0] or 0):
+        errors += counts['errors']
+        rate_limited += counts['rate_limited']
+        if error:
+            failed = True
+            print(f"[ERR] Connection {label or 1}: {error}", file=sys.stderr)
+        elif parallel > 1:
+            print(f"Connection {label}: {count} commands in {seconds:.3f}s", file=sys.stderr)
+    rate = len(blocks) / elapsed if elapsed > 0 else 0.0
+    print(f"{len(blocks)} commands over {parallel} connection(s) in {elapsed:.3f}s ({rate:.1f} commands/s)",
+          file=sys.stderr)
+    if errors:
+        print(f"[ERR] {errors} error replies, {rate_limited} of them rate limited", file=sys.stderr)
+    if failed or errors:
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Client for messenger with chat, tasks, and AI",
+        epilog="Example: python3 client.py localhost:7002 --exec script.txt --user alice")
+    parser.add_argument('address', metavar='host:port')
+    parser.add_argument('--exec', metavar='FILE',
+                        help="run commands from FILE ('-' for stdin) instead of the menu")
+    parser.add_argument('--user', help="username for --exec")
+    parser.add_argument('--password', help="password for --exec (prompted if omitted)")
+    parser.add_argument('--token', help="resume token printed by login, instead of --user/--password")
+    parser.add_argument('--parallel', type=int, default=1, metavar='N',
+                        help="spread --exec commands over N connections (default: 1)")
+    return parser.parse_args()
+
+
 def main():
     """Main client loop"""
-    if len(sys.argv) < 2:
-        print("Usage: python3 client.py <host:port>")
-        print("Example: python3 client.py localhost:7002")
-        sys.exit(1)
+    args = parse_args()
     
     try:
-        host_port = sys.argv[1].split(':')
+        host_port = args.address.split(':')
         host = host_port[0]
         port = int(host_port[1])
     except:
         print("[ERR] Invalid host:port format")
         sys.exit(1)
     
+    if args.exec:
+        run_script(host, port, args)
+        return
+    
     # Connect to server
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
@@ -239,15 +545,17 @@ def main():
         elif choice == '3':
             ai_menu(sock)
         elif choice == '4':
+            file_menu(sock)
+        elif choice == '5':
             response = send_command(sock, 'help')
             print(response)
-        elif choice == '5':
+        elif choice == '6':
             response = send_command(sock, 'logout')
             print(response)
             if '[OK]' in response:
                 if not auth_menu(sock):
                     break
-        elif choice == '6':
+        elif choice == '7':
             response = send_command(sock, 'quit')
             print(response)
             break
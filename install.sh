@@ -58,6 +58,7 @@ echo "      Permissions set"
 echo "[5/6] Installing systemd service..."
 if [ -f "$SCRIPT_DIR/serv_mess.service" ]; then
     cp "$SCRIPT_DIR/serv_mess.service" /etc/systemd/system/
+    cp "$SCRIPT_DIR/serv_mess.socket" /etc/systemd/system/
     systemctl daemon-reload
     echo "      Systemd service installed"
 else
@@ -66,8 +67,8 @@ fi
 
 # Step 6: Start service
 echo "[6/6] Starting service..."
-systemctl enable "$SERVICE_NAME"
-systemctl start "$SERVICE_NAME"
+systemctl enable "$SERVICE_NAME.socket" "$SERVICE_NAME"
+systemctl start "$SERVICE_NAME.socket" "$SERVICE_NAME"
 echo "      Service started"
 
 echo ""
@@ -84,6 +85,7 @@ echo "  View status:   systemctl status $SERVICE_NAME"
 echo "  View logs:     tail -f $INSTALL_PATH/logs/server.log"
 echo "  Stop service:  systemctl stop $SERVICE_NAME"
 echo "  Restart:       systemctl restart $SERVICE_NAME"
+echo "  Reload:        systemctl reload $SERVICE_NAME  (restart without dropping clients)"
 echo ""
 echo "Test connection:"
 echo "  nc localhost 7002"
@@ -21,6 +21,7 @@ print_usage() {
     echo "  dev        - Run server directly"
     echo "  stop       - Stop service"
     echo "  restart    - Restart service"
+    echo "  reload     - Restart without dropping connections (after update)"
     echo "  status     - Show status"
     echo "  logs       - Show logs"
     echo "  logs -f    - Follow logs"
@@ -69,6 +70,14 @@ restart() {
 }
 
 
+reload() {
+    echo "Reloading $SERVICE_NAME (zero-downtime handoff)..."
+    sudo systemctl reload "$SERVICE_NAME"
+    sleep 1
+    sudo systemctl status "$SERVICE_NAME"
+}
+
+
 status() {
     sudo systemctl status "$SERVICE_NAME"
 }
@@ -119,6 +128,7 @@ case "$1" in
     dev) dev ;;
     stop) stop ;;
     restart) restart ;;
+    reload) reload ;;
     status) status ;;
     logs) logs "$2" ;;
     update) update ;;
@@ -7,12 +7,23 @@ Features: authentication, chat, task management, Gemini AI with Key Rotation
 import socket
 import threading
 import json
+import io
 from datetime import datetime
 import os
 import sys
 import logging
 import hashlib
+import re
 import uuid
+import secrets
+import argparse
+import fcntl
+import queue
+import signal
+import subprocess
+import time
+from contextlib import contextmanager
+from itertools import islice
 from typing import Dict, List, Optional, Tuple
 
 # Google Gemini Imports
@@ -29,6 +40,10 @@ HOST = '0.0.0.0'
 PORT = 7002
 DATA_DIR = 'data'
 LOGS_DIR = 'logs'
+FILES_DIR = 'shared_files'
+BLOBS_DIR = os.path.join(FILES_DIR, '.blobs')       # content-addressed by sha256
+PARTIAL_DIR = os.path.join(FILES_DIR, '.partial')   # uploads in progress (resumable)
+CHANNELS_DIR = os.path.join(DATA_DIR, 'channels')   # one message log per chat channel
 
 # ==========================================
 # CONFIGURATION: GEMINI KEYS & MODEL
@@ -43,8 +58,11 @@ GEMINI_API_KEYS = [
 # Используем быструю модель (Gemini 2.0 Flash Experimental - актуальный аналог "3 flash" на данный момент)
 GEMINI_MODEL_NAME = "gemini-3-flash-preview"  # Проверьте актуальное имя модели в документации Google GenAI
 
+# Пользователи, которым доступны команды admin (профилирование, диагностика памяти)
+ADMIN_USERS: List[str] = []
+
 # Create directories if they don't exist
-for d in [DATA_DIR, LOGS_DIR]:
+for d in [DATA_DIR, LOGS_DIR, BLOBS_DIR, PARTIAL_DIR, CHANNELS_DIR]:
     if not os.path.exists(d):
         os.makedirs(d)
 
@@ -69,20 +87,350 @@ ch.setFormatter(formatter)
 logger.addHandler(fh)
 logger.addHandler(ch)
 
+# ==========================================
+# COMPACT RECORDS
+# ==========================================
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_time(ts: int) -> str:
+    """Format an epoch timestamp the way it is stored in the data files"""
+    return time.strftime(TIME_FORMAT, time.localtime(ts))
+
+
+def parse_time(value: str) -> int:
+    """Parse a stored local time string into an epoch timestamp"""
+    return int(time.mktime(time.strptime(value, TIME_FORMAT)))
+
+
+class ChatMessage:
+    """
+    Chat message with an interned sender and an integer timestamp.
+    Serialized as {from, text, time} for compatibility with chat.json.
+    """
+    __slots__ = ('sender', 'text', 'ts')
+
+    def __init__(self, sender: str, text: str, ts: int):
+        self.sender = sys.intern(sender)
+        self.text = text
+        self.ts = ts
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'ChatMessage':
+        return cls(d['from'], d['text'], parse_time(d['time']))
+
+    def to_dict(self) -> dict:
+        return {'from': self.sender, 'text': self.text, 'time': format_time(self.ts)}
+
+
+class Task:
+    """
+    Task with interned author/status and an integer creation timestamp.
+    Serialized with the same keys as tasks.json.
+    """
+    __slots__ = ('title', 'description', 'solution', 'status', 'created_by', 'created_at')
+
+    def __init__(self, title: str, description: str, solution: str,
+                 status: str, created_by: str, created_at: int):
+        self.title = title
+        self.description = description
+        self.solution = solution
+        self.status = sys.intern(status)
+        self.created_by = sys.intern(created_by)
+        self.created_at = created_at
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'Task':
+        return cls(d['title'], d['description'], d['solution'], d['status'],
+                   d['created_by'], parse_time(d['created_at']))
+
+    def to_dict(self) -> dict:
+        return {
+            'title': self.title,
+            'description': self.description,
+            'solution': self.solution,
+            'status': self.status,
+            'created_by': self.created_by,
+            'created_at': format_time(self.created_at)
+        }
+
+
+class SessionStore:
+    """
+    Login sessions keyed by resume token, with sliding expiry (SESSION_TTL)
+    and a size cap (MAX_SESSIONS). Entries are kept in order of last use
+    (dicts keep insertion order), so expired and least recently used
+    sessions are always at the front. Caller must hold the lock.
+    """
+    def __init__(self):
+        self.entries: Dict[str, Tuple[str, float]] = {}   # {token: (username, expires_at)}
+
+    def set(self, token: str, username: str, expires_at: float):
+        """Add or renew a session, moving it to the back"""
+        self.entries.pop(token, None)
+        self.entries[token] = (username, expires_at)
+        while len(self.entries) > MAX_SESSIONS:
+            self.entries.pop(next(iter(self.entries)))
+
+    def renew(self, token: str, expires_at: float):
+        """Extend a session that still exists; logged out, expired or evicted ones stay gone"""
+        entry = self.entries.get(token)
+        if entry is not None and entry[1] > time.time():
+            self.set(token, entry[0], expires_at)
+
+    def get(self, token: str) -> Optional[str]:
+        """Username of a live session, or None"""
+        entry = self.entries.get(token)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def pop(self, token: str):
+        self.entries.pop(token, None)
+
+    def sweep(self) -> int:
+        """Drop expired sessions, returns how many were dropped"""
+        now = time.time()
+        expired = []
+        for token, (_, expires_at) in self.entries.items():
+            if expires_at > now:
+                break
+            expired.append(token)
+        for token in expired:
+            del self.entries[token]
+        return len(expired)
+
+    def to_dict(self) -> dict:
+        return {token: list(entry) for token, entry in self.entries.items()}
+
+    def load(self, data: dict):
+        """Replace contents from to_dict() output (or a plain {token: username} map)"""
+        self.entries = {}
+        for token, entry in data.items():
+            if isinstance(entry, str):
+                entry = (entry, time.time() + SESSION_TTL)
+            self.set(token, entry[0], entry[1])
+
+    def __contains__(self, token):
+        return token in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Chat channels: 'general' keeps data/chat.json, the others data/channels/<name>.json
+DEFAULT_CHANNEL = 'general'
+MAX_CHANNELS = 1000
+CHANNEL_NAME_RE = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+
+
+class Channel:
+    """
+    A chat channel: its own message log, lock, render version and the
+    connections of this process subscribed to new messages (chat join).
+    Sends to different channels never wait on each other, nor on the
+    global lock. Lock order: global lock, then a channel's lock.
+    """
+    def __init__(self, name: str, messages: Optional[List[ChatMessage]] = None):
+        self.name = name
+        self.messages: List[ChatMessage] = messages or []
+        self.lock = threading.RLock()
+        self.version = 0   # bumped on every append (render cache key)
+        self.subscribers: Dict[object, str] = {}   # {Connection: username}
+        # Stored records that failed to parse, as (position, raw record); saved back unchanged
+        self.unparsed: List[Tuple[int, object]] = []
+
+    def changed(self):
+        """Mark the log as mutated. Caller must hold the channel's lock."""
+        self.version += 1
+        render_cache.invalidate('chat', self.name)
+
+    def subscribe(self, conn, username: str):
+        with self.lock:
+            self.subscribers[conn] = username
+
+    def unsubscribe(self, conn):
+        with self.lock:
+            self.subscribers.pop(conn, None)
+
+    def deliver(self, message: ChatMessage, origin: Optional[str] = None):
+        """
+        Push a new message to subscribers other than the connection that sent
+        it (`origin`, see Connection.origin); never blocks
+        """
+        with self.lock:
+            targets = [conn for conn in self.subscribers if conn.origin != origin]
+        data = f"[#{self.name}] {message.sender}: {message.text}\n".encode('utf-8')
+        for conn in targets:
+            if not conn.push(data):
+                self.unsubscribe(conn)
+
+
+def measure_record_memory(count: int):
+    """Print traced memory of `count` chat messages and tasks, as dicts vs records"""
+    import tracemalloc
+
+    def traced(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        data = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del data
+        return size
+
+    now = int(time.time())
+    users = [f"user{i}" for i in range(50)]
+    # Formatting/parsing happens outside the traced region so only storage is measured
+    stamps = [format_time(now + i) for i in range(count)]
+    texts = [f"message number {i}" for i in range(count)]
+
+    results = [
+        ("chat as dict", traced(lambda: [
+            {'from': ''.join(users[i % 50]), 'text': texts[i], 'time': ''.join(stamps[i])}
+            for i in range(count)])),
+        ("chat as ChatMessage", traced(lambda: [
+            ChatMessage(''.join(users[i % 50]), texts[i], now + i)
+            for i in range(count)])),
+        ("tasks as dict", traced(lambda: {
+            f"{i:08x}": {'title': texts[i], 'description': '', 'solution': '',
+                         'status': ''.join('pending'), 'created_by': ''.join(users[i % 50]),
+                         'created_at': ''.join(stamps[i])}
+            for i in range(count)})),
+        ("tasks as Task", traced(lambda: {
+            f"{i:08x}": Task(texts[i], '', '', ''.join('pending'), ''.join(users[i % 50]), now + i)
+            for i in range(count)})),
+    ]
+
+    print(f"Memory for {count} records (excluding shared message text):")
+    for name, size in results:
+        print(f"  {name:<22} {size / 1024 / 1024:8.2f} MiB  {size / count:7.1f} B/record")
+
+
+def check_data_roundtrip() -> bool:
+    """Load the data files and check that saving them would reproduce each one byte for byte"""
+    load_data()
+    ok = True
+    for name in all_collections():
+        path = collection_path(name)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            stored = f.read()
+        out = io.StringIO()
+        dump_collection(name, out)
+        saved = out.getvalue()
+        if saved == stored:
+            print(f"  {path:<40} ok")
+            continue
+        ok = False
+        line = next((i for i, (a, b) in enumerate(zip(stored.splitlines(), saved.splitlines()), 1) if a != b),
+                    min(stored.count('\n'), saved.count('\n')) + 1)
+        print(f"  {path:<40} DIFFERS from line {line}")
+    return ok
+
+
 # Data storage
 users_db: Dict[str, dict] = {}  # {username: {password_hash, created_at}}
-sessions: Dict[str, str] = {}   # {session_id: username}
-chat_messages: List[dict] = []
-tasks: Dict[str, dict] = {}      # {task_id: {title, description, solution, status, created_by, created_at}}
+sessions = SessionStore()   # {token: (username, expires_at)}
+channels: Dict[str, Channel] = {DEFAULT_CHANNEL: Channel(DEFAULT_CHANNEL)}
+channels_lock = threading.Lock()   # guards adding/replacing channels only
+tasks: Dict[str, Task] = {}      # {task_id: Task}
+unparsed_tasks: List[Tuple[int, Tuple[str, object]]] = []   # [(position, (task_id, raw record))]
 ai_chat_history: Dict[str, List[dict]] = {}  # {username: [{role, content}]}
+files: Dict[str, dict] = {}      # {name: {sha256, size, owner, uploaded_at}}
+
+# Reentrant so a batch can hold it across commands that lock themselves
+lock = threading.RLock()
+
+# Collection versions, bumped on every mutation (used as render cache keys)
+tasks_version = 0
+
+# Connection limits (per process; in multi-worker mode each worker applies them)
+MAX_CONNECTIONS = 500
+MAX_CONNECTIONS_PER_IP = 20
+LOGIN_TIMEOUT = 60            # seconds to log in after connecting
+IDLE_TIMEOUT = 900            # seconds without a command before disconnecting
+SEND_TIMEOUT = 30             # seconds a client may stall a write before disconnecting
+OUTPUT_HIGH_WATER = 1024 * 1024   # unread pushed output (live chat) before disconnecting
+
+# Login sessions: `login` returns a token that `resume <token>` accepts on a new connection
+SESSION_TTL = 24 * 3600       # seconds a session survives without being used
+MAX_SESSIONS = 100000         # least recently used sessions are dropped beyond this
+SESSION_SWEEP_INTERVAL = 60   # seconds between removals of expired sessions
+SESSION_RENEW_INTERVAL = 300  # an active connection renews its session at most this often
+MAX_LINE_LENGTH = 64 * 1024
 
-lock = threading.Lock()
+# Server-side caps on a single view; larger requests get a continuation cursor
+MAX_CHAT_VIEW = 500
+DEFAULT_CHAT_VIEW = 100       # messages shown by `chat view` without a (positive) count
+MAX_TASK_LIST = 200
+RENDER_CACHE_SIZE = 256
 
 # Data file paths
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 CHAT_FILE = os.path.join(DATA_DIR, 'chat.json')
 TASKS_FILE = os.path.join(DATA_DIR, 'tasks.json')
 AI_CHAT_FILE = os.path.join(DATA_DIR, 'ai_chat.json')
+FILES_FILE = os.path.join(DATA_DIR, 'files.json')
+
+DATA_FILES = {
+    'users': USERS_FILE,
+    'chat': CHAT_FILE,
+    'tasks': TASKS_FILE,
+    'ai_chat': AI_CHAT_FILE,
+    'files': FILES_FILE,
+}
+
+# Shared files (file upload/download/list/delete)
+MAX_FILE_SIZE = 100 * 1024 * 1024
+USER_FILE_QUOTA = 500 * 1024 * 1024
+FILE_CHUNK_SIZE = 64 * 1024
+MAX_PARTIAL_UPLOADS = 10      # unfinished uploads kept per user for resuming
+PARTIAL_TTL = 24 * 3600       # seconds an abandoned upload is kept before it is deleted
+FILE_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$')
+
+# Per-user rate limits by command: {command: {rate: tokens/sec, burst: bucket size}}.
+# Overridden by RATE_LIMITS_FILE if present; reloaded on SIGHUP.
+RATE_LIMITS_FILE = os.path.join(DATA_DIR, 'rate_limits.json')
+DEFAULT_RATE_LIMITS = {
+    'chat': {'rate': 5, 'burst': 20},
+    'task': {'rate': 5, 'burst': 50},
+    'ai': {'rate': 0.2, 'burst': 3},
+    'batch': {'rate': 0.5, 'burst': 5},
+    'file': {'rate': 2, 'burst': 10},
+}
+
+# Diagnostics (admin profile / admin mem, SIGUSR1)
+PROFILE_SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 600
+SIGNAL_PROFILE_SECONDS = 30
+# Innermost frames of threads that are just waiting; excluded from busy samples
+IDLE_FRAMES = {'readline', 'read_into', 'accept', 'wait', '_read_loop',
+               '_accept_loop', '_peer_reader', '_peer_writer', '_write_loop', '_save_loop'}
+
+# Batched command execution
+MAX_BATCH_COMMANDS = 1000
+# Authentication commands would change the login of the whole connection mid-batch
+BATCH_FORBIDDEN_COMMANDS = {'ai', 'batch', 'file', 'quit', 'exit', 'register', 'login', 'resume', 'logout'}
+
+# Multiline task field uploads (task add-desc/add-sol/append-desc/append-sol)
+MAX_UPLOAD_SIZE = 256 * 1024
+UPLOAD_ACK_LINES = 100
+
+# Multi-worker mode: workers talk to the coordinator over this unix socket
+BUS_SOCKET = os.path.join(DATA_DIR, 'bus.sock')
+WORKER_RESPAWN_DELAY = 1.0
+
+# Zero-downtime restart (SIGUSR2): the listener and live connections move to a new process
+HANDOFF_SOCKET = os.path.join(DATA_DIR, 'handoff.sock')
+HANDOFF_STATE_FILE = os.path.join(DATA_DIR, 'handoff.json')
+HANDOFF_START_TIMEOUT = 120   # seconds for the new process to start up
+HANDOFF_DRAIN_TIMEOUT = 30    # seconds for busy connections to reach a command boundary
+READ_POLL_INTERVAL = 1.0      # blocking reads/accepts wake up this often to notice a handoff
+
+# False in worker processes: the coordinator is the only process writing data files
+persist_data = True
 
 
 # ==========================================
@@ -152,14 +500,472 @@ class GeminiManager:
 gemini_manager = GeminiManager(GEMINI_API_KEYS, GEMINI_MODEL_NAME)
 
 
+# ==========================================
+# RENDER CACHE
+# ==========================================
+class RenderCache:
+    """
+    Cache of pre-encoded responses keyed by (kind, version, *query).
+    Entries of a kind are dropped when that collection is mutated, so
+    repeated views between writes are served without re-rendering.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries: Dict[tuple, bytes] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, data: bytes):
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                # Evict the oldest entry (dicts keep insertion order)
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[key] = data
+
+    def invalidate(self, *prefix):
+        """Drop entries whose key starts with `prefix`, e.g. ('tasks',) or ('chat', channel)"""
+        n = len(prefix)
+        with self.lock:
+            for key in [k for k in self.entries if k[:n] == prefix]:
+                del self.entries[key]
+
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+
+def tasks_changed():
+    """Mark tasks as mutated. Caller must hold the lock."""
+    global tasks_version
+    tasks_version += 1
+    render_cache.invalidate('tasks')
+
+
+# ==========================================
+# STATE EVENTS & NOTIFICATION BUS
+# ==========================================
+def apply_event(event: dict):
+    """Apply a state change event to local state. Caller must hold the lock."""
+    global users_db, tasks, ai_chat_history, files
+    kind = event['type']
+
+    if kind == 'user_set':
+        users_db[event['username']] = event['user']
+    elif kind == 'session_set':
+        sessions.set(event['session_id'], event['username'], event['expires_at'])
+    elif kind == 'session_touch':
+        sessions.renew(event['session_id'], event['expires_at'])
+    elif kind == 'session_del':
+        sessions.pop(event['session_id'])
+    elif kind == 'channel_create':
+        get_or_create_channel(event['channel'])
+    elif kind == 'chat_append':
+        channel = get_or_create_channel(event['channel'])
+        message = ChatMessage.from_dict(event['message'])
+        with channel.lock:
+            channel.messages.append(message)
+            channel.changed()
+        channel.deliver(message, event.get('origin'))
+    elif kind == 'task_set':
+        tasks[event['task_id']] = Task.from_dict(event['task'])
+        tasks_changed()
+    elif kind == 'task_update':
+        # Only the changed fields, so concurrent edits of other fields survive
+        task = tasks.get(event['task_id'])
+        if task is not None:
+            for field, value in event['fields'].items():
+                setattr(task, field, sys.intern(value) if field == 'status' else value)
+            tasks_changed()
+    elif kind == 'task_del':
+        tasks.pop(event['task_id'], None)
+        tasks_changed()
+    elif kind == 'task_append':
+        task = tasks.get(event['task_id'])
+        if task is not None:
+            current = getattr(task, event['field'])
+            setattr(task, event['field'], f"{current}\n{event['text']}" if current else event['text'])
+            tasks_changed()
+    elif kind == 'ai_append':
+        ai_chat_history.setdefault(event['username'], []).append(event['message'])
+    elif kind == 'ai_clear':
+        if event['username'] in ai_chat_history:
+            ai_chat_history[event['username']] = []
+    elif kind == 'file_set':
+        files[event['name']] = event['file']
+    elif kind == 'file_del':
+        files.pop(event['name'], None)
+    elif kind == 'snapshot':
+        users_db = event['users']
+        sessions.load(event['sessions'])
+        load_channels(event['channels'])
+        tasks = {task_id: Task.from_dict(t) for task_id, t in event['tasks'].items()}
+        ai_chat_history = event['ai_chat']
+        files = event['files']
+        tasks_changed()
+    else:
+        logger.warning(f"[Bus] Unknown event type: {kind}")
+
+
+# Data file affected by each event type (session events are not persisted;
+# chat events are per channel, see event_collection)
+EVENT_COLLECTIONS = {
+    'user_set': 'users',
+    'task_set': 'tasks',
+    'task_update': 'tasks',
+    'task_del': 'tasks',
+    'task_append': 'tasks',
+    'ai_append': 'ai_chat',
+    'ai_clear': 'ai_chat',
+    'file_set': 'files',
+    'file_del': 'files',
+}
+
+
+def event_collection(event: dict) -> Optional[str]:
+    """Data collection changed by an event, or None if it is not persisted"""
+    if event['type'] in ('chat_append', 'channel_create'):
+        return channel_collection(event['channel'])
+    return EVENT_COLLECTIONS.get(event['type'])
+
+
+def snapshot_event() -> dict:
+    """Full state as a single event. Caller must hold the lock."""
+    return {
+        'type': 'snapshot',
+        'users': users_db,
+        'sessions': sessions.to_dict(),
+        'channels': {name: collection_data(channel_collection(name)) for name in list(channels)},
+        'tasks': {task_id: t.to_dict() for task_id, t in tasks.items()},
+        'ai_chat': ai_chat_history,
+        'files': files,
+    }
+
+
+def commit(event: dict):
+    """Apply a state change locally and publish it to other workers. Caller must hold the lock."""
+    apply_event(event)
+    notification_bus.publish(event)
+
+
+def check_event(event: dict) -> Optional[str]:
+    """
+    Rejection reason for an ordered event against the authoritative state,
+    or None if it may be applied. Caller must hold the lock.
+    """
+    kind = event['type']
+    if kind == 'user_set' and event.get('create') and event['username'] in users_db:
+        return "User already exists"
+    if kind == 'channel_create' and event['channel'] not in channels and len(channels) >= MAX_CHANNELS:
+        return f"Channel limit reached ({MAX_CHANNELS})"
+    if kind == 'task_set' and event['task_id'] in tasks:
+        return "Task already exists"
+    if kind in ('task_update', 'task_append', 'task_del') and event['task_id'] not in tasks:
+        return "Task not found"
+    if kind == 'file_set':
+        old = files.get(event['name'])
+        if old and old['owner'] != event['file']['owner']:
+            return "File belongs to another user"
+    return None
+
+
+def commit_ordered(event: dict) -> Optional[str]:
+    """
+    Apply a state change that needs uniqueness or a single order across
+    workers (users, chat, channels, tasks, AI history, file_set). In multi-worker
+    mode the coordinator checks and orders it, and it is applied here in the
+    coordinator's order. Returns None if applied, else the rejection reason.
+    Must not be called while holding a channel's lock.
+    """
+    if notification_bus.sock is not None:
+        return notification_bus.request(event)
+    if event['type'] == 'chat_append':
+        # Appends to different channels don't contend on the global lock
+        apply_event(event)
+        return None
+    with lock:
+        reason = check_event(event)
+        if reason is None:
+            apply_event(event)
+        return reason
+
+
+class NotificationBus:
+    """
+    Worker side of the local notification bus.
+    Events are newline-delimited JSON. Outgoing events are queued so that
+    publishing under the global lock never blocks on the socket.
+    Inactive (publish is a no-op) in single-process mode.
+    """
+    def __init__(self):
+        self.sock = None
+        self.outbox: "queue.Queue[bytes]" = queue.Queue()
+        # Events read from the coordinator, applied in order by whoever holds the lock
+        self.incoming: List[dict] = []
+        self.incoming_cond = threading.Condition()
+        self.requests: Dict[int, dict] = {}   # {request_id: {done, reason}} awaiting the coordinator
+        self.next_request = 0
+
+    def connect(self, path, timeout=10.0):
+        """Connect to the coordinator and wait for the initial state snapshot."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(path)
+                break
+            except OSError:
+                self.sock.close()
+                self.sock = None
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        reader = self.sock.makefile('rb')
+        snapshot = json.loads(reader.readline())
+        with lock:
+            apply_event(snapshot)
+
+        threading.Thread(target=self._read_loop, args=(reader,), daemon=True).start()
+        threading.Thread(target=self._apply_loop, daemon=True).start()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def publish(self, event: dict):
+        if self.sock is None:
+            return
+        self.outbox.put(json.dumps(event).encode('utf-8') + b'\n')
+
+    def _write_loop(self):
+        try:
+            while True:
+                self.sock.sendall(self.outbox.get())
+        except OSError as e:
+            logger.error(f"[Bus] Lost connection to coordinator: {e}")
+            os._exit(1)
+
+    def _read_loop(self, reader):
+        # Never waits for the lock: a holder blocked in request() needs the next reply read
+        for line in reader:
+            event = json.loads(line)
+            with self.incoming_cond:
+                if event['type'] == 'rate_reply':
+                    # Not a state change: answered right away, outside the event order
+                    waiter = self.requests.get(event['request_id'])
+                    if waiter is not None:
+                        waiter['done'] = True
+                        waiter['retry_after'] = event['retry_after']
+                else:
+                    self.incoming.append(event)
+                self.incoming_cond.notify_all()
+        logger.error("[Bus] Coordinator closed the bus")
+        os._exit(1)
+
+    def _apply_loop(self):
+        while True:
+            with self.incoming_cond:
+                while not self.incoming:
+                    self.incoming_cond.wait()
+            with lock:
+                self.drain()
+
+    def drain(self):
+        """Apply received events in order. Caller must hold the lock."""
+        while True:
+            with self.incoming_cond:
+                if not self.incoming:
+                    return
+                event = self.incoming.pop(0)
+            if event['type'] != 'reply':
+                apply_event(event)
+                continue
+            if event['reason'] is None:
+                apply_event(event['event'])
+            with self.incoming_cond:
+                waiter = self.requests.get(event['request_id'])
+                if waiter is not None:
+                    waiter['done'] = True
+                    waiter['reason'] = event['reason']
+                self.incoming_cond.notify_all()
+
+    def request(self, event: dict) -> Optional[str]:
+        """
+        Send an ordered event to the coordinator and wait until its reply is
+        applied here. The caller may hold the lock: then it applies incoming
+        events itself, since the apply thread cannot take the lock.
+        """
+        with self.incoming_cond:
+            self.next_request += 1
+            request_id = self.next_request
+            waiter = self.requests[request_id] = {'done': False, 'reason': None}
+        self.outbox.put(json.dumps({'type': 'request', 'request_id': request_id, 'event': event})
+                        .encode('utf-8') + b'\n')
+        while True:
+            with lock:
+                self.drain()
+            with self.incoming_cond:
+                if waiter['done']:
+                    del self.requests[request_id]
+                    return waiter['reason']
+                if not self.incoming:
+                    self.incoming_cond.wait()
+
+    def check_rate(self, username: str, command: str) -> float:
+        """Take a token from the coordinator's bucket; returns the retry-after, 0 if allowed"""
+        with self.incoming_cond:
+            self.next_request += 1
+            request_id = self.next_request
+            waiter = self.requests[request_id] = {'done': False, 'retry_after': 0.0}
+        self.outbox.put(json.dumps({'type': 'rate_check', 'request_id': request_id,
+                                    'username': username, 'command': command}).encode('utf-8') + b'\n')
+        with self.incoming_cond:
+            while not waiter['done']:
+                self.incoming_cond.wait()
+            del self.requests[request_id]
+        return waiter['retry_after']
+
+notification_bus = NotificationBus()
+
+
+class BusHub:
+    """
+    Coordinator side of the notification bus.
+    Holds the authoritative copy of the state, fans every event out to the
+    other workers and persists changes from a single saver thread.
+    Ordered events arrive as requests: they are checked and applied here,
+    answered with a reply to the sender and broadcast to everyone else.
+    Rate limit checks are answered from the coordinator's buckets.
+    """
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(64)
+        self.peers: Dict[int, "queue.Queue[bytes]"] = {}
+        self.peers_lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.dirty_collections = set()
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._save_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            conn, _ = self.server.accept()
+            outbox: "queue.Queue[bytes]" = queue.Queue()
+            with lock:
+                # Snapshot is queued first, so the worker sees every later event
+                outbox.put(json.dumps(snapshot_event()).encode('utf-8') + b'\n')
+                with self.peers_lock:
+                    self.peers[conn.fileno()] = outbox
+            threading.Thread(target=self._peer_reader, args=(conn,), daemon=True).start()
+            threading.Thread(target=self._peer_writer, args=(conn, outbox), daemon=True).start()
+
+    def _peer_reader(self, conn):
+        peer_id = conn.fileno()
+        try:
+            for line in conn.makefile('rb'):
+                event = json.loads(line)
+                if event['type'] == 'rate_check':
+                    retry_after = rate_limiter.check(event['username'], event['command'])
+                    reply = {'type': 'rate_reply', 'request_id': event['request_id'], 'retry_after': retry_after}
+                    with self.peers_lock:
+                        self.peers[peer_id].put(json.dumps(reply).encode('utf-8') + b'\n')
+                    continue
+                with lock:
+                    if event['type'] == 'request':
+                        request, event = event, event['event']
+                        reason = check_event(event)
+                        reply = {'type': 'reply', 'request_id': request['request_id'],
+                                 'reason': reason, 'event': event}
+                        with self.peers_lock:
+                            self.peers[peer_id].put(json.dumps(reply).encode('utf-8') + b'\n')
+                        if reason is not None:
+                            continue
+                        line = json.dumps(event).encode('utf-8') + b'\n'
+                    apply_event(event)
+                    with self.peers_lock:
+                        for other_id, outbox in self.peers.items():
+                            if other_id != peer_id:
+                                outbox.put(line)
+                    collection = event_collection(event)
+                    if collection:
+                        self.dirty_collections.add(collection)
+                        self.dirty.set()
+        except (OSError, ValueError) as e:
+            logger.error(f"[Bus] Worker connection error: {e}")
+        finally:
+            with self.peers_lock:
+                self.peers.pop(peer_id, None)
+            conn.close()
+
+    def _peer_writer(self, conn, outbox):
+        try:
+            while True:
+                conn.sendall(outbox.get())
+        except OSError:
+            pass
+
+    def _save_loop(self):
+        # Coalesces bursts of events into a single write
+        while True:
+            self.dirty.wait()
+            self.dirty.clear()
+            with lock:
+                collections = self.dirty_collections
+                self.dirty_collections = set()
+                save_data(*collections)
+
+
 def hash_password(password: str) -> str:
     """Hash password using SHA256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
 
+def get_or_create_channel(name: str) -> Channel:
+    with channels_lock:
+        channel = channels.get(name)
+        if channel is None:
+            channel = channels[name] = Channel(name)
+        return channel
+
+
+def merge_unparsed(records: list, unparsed: List[Tuple[int, object]]) -> list:
+    """Put records kept unparsed back at their stored positions among the parsed ones"""
+    if not unparsed:
+        return records
+    merged = list(records)
+    for position, raw in unparsed:
+        merged.insert(min(position, len(merged)), raw)
+    return merged
+
+
+def parse_channel(name: str, messages: list) -> Channel:
+    """Channel from stored messages; ones that don't parse are logged and kept as they are"""
+    channel = Channel(name)
+    for i, m in enumerate(messages):
+        try:
+            channel.messages.append(ChatMessage.from_dict(m))
+        except Exception as e:
+            logger.error(f"Keeping unparsable message {i} in #{name} as is: {e!r}")
+            channel.unparsed.append((i, m))
+    return channel
+
+
+def load_channels(data: Dict[str, list]):
+    """Replace all channels with {name: [message dicts]}; general always exists"""
+    loaded = {name: parse_channel(name, messages) for name, messages in data.items()}
+    loaded.setdefault(DEFAULT_CHANNEL, Channel(DEFAULT_CHANNEL))
+    with channels_lock:
+        channels.clear()
+        channels.update(loaded)
+    render_cache.invalidate('chat')
+
+
 def load_data():
     """Load all data from files"""
-    global users_db, chat_messages, tasks, ai_chat_history
+    global users_db, tasks, unparsed_tasks, ai_chat_history, files
     
     if os.path.exists(USERS_FILE):
         try:
@@ -168,19 +974,41 @@ def load_data():
         except:
             users_db = {}
     
+    channel_data = {}
     if os.path.exists(CHAT_FILE):
         try:
             with open(CHAT_FILE, 'r') as f:
-                chat_messages = json.load(f)
+                channel_data[DEFAULT_CHANNEL] = json.load(f)
         except:
-            chat_messages = []
+            pass
+    
+    for filename in sorted(os.listdir(CHANNELS_DIR)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.json' or name == DEFAULT_CHANNEL or not CHANNEL_NAME_RE.match(name):
+            continue
+        try:
+            with open(os.path.join(CHANNELS_DIR, filename), 'r') as f:
+                channel_data[name] = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load channel #{name}: {e}")
+    load_channels(channel_data)
     
     if os.path.exists(TASKS_FILE):
         try:
             with open(TASKS_FILE, 'r') as f:
-                tasks = json.load(f)
-        except:
-            tasks = {}
+                stored = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load tasks: {e}")
+            stored = {}
+        # A bad record must cost neither the others nor itself: it is saved back as it was
+        tasks = {}
+        unparsed_tasks = []
+        for i, (task_id, t) in enumerate(stored.items()):
+            try:
+                tasks[task_id] = Task.from_dict(t)
+            except Exception as e:
+                logger.error(f"Keeping unparsable task {task_id} as is: {e!r}")
+                unparsed_tasks.append((i, (task_id, t)))
     
     if os.path.exists(AI_CHAT_FILE):
         try:
@@ -188,19 +1016,83 @@ def load_data():
                 ai_chat_history = json.load(f)
         except:
             ai_chat_history = {}
+    
+    if os.path.exists(FILES_FILE):
+        try:
+            with open(FILES_FILE, 'r') as f:
+                files = json.load(f)
+        except:
+            files = {}
+
+    tasks_changed()
+
+
+# Set per thread while a batch runs: save_data() records collections here instead of writing
+deferred_saves = threading.local()
+
+
+def channel_collection(name: str) -> str:
+    """Data collection of a chat channel: 'chat' for general, 'chat:<name>' for the rest"""
+    return 'chat' if name == DEFAULT_CHANNEL else f'chat:{name}'
+
+
+def collection_channel(collection: str) -> str:
+    return collection[5:] if collection.startswith('chat:') else DEFAULT_CHANNEL
 
 
-def save_data():
-    """Save all data to files"""
+def collection_path(name: str) -> str:
+    if name.startswith('chat:'):
+        return os.path.join(CHANNELS_DIR, f"{collection_channel(name)}.json")
+    return DATA_FILES[name]
+
+
+def all_collections() -> List[str]:
+    return list(DATA_FILES) + [channel_collection(name) for name in list(channels) if name != DEFAULT_CHANNEL]
+
+
+def collection_data(name: str):
+    """JSON-serializable form of a data collection"""
+    if name == 'users':
+        return users_db
+    if name == 'chat' or name.startswith('chat:'):
+        channel = channels[collection_channel(name)]
+        with channel.lock:
+            return merge_unparsed([m.to_dict() for m in channel.messages], channel.unparsed)
+    if name == 'tasks':
+        return dict(merge_unparsed([(task_id, t.to_dict()) for task_id, t in tasks.items()], unparsed_tasks))
+    if name == 'ai_chat':
+        return ai_chat_history
+    if name == 'files':
+        return files
+    raise KeyError(name)
+
+
+def dump_collection(name: str, f):
+    """Write a collection in its data file format"""
+    json.dump(collection_data(name), f, indent=2)
+
+
+def collection_lock(name: str):
+    """Lock that serializes a collection's writes: its channel's lock for chat, else the global lock"""
+    if name == 'chat' or name.startswith('chat:'):
+        return channels[collection_channel(name)].lock
+    return lock
+
+
+def save_data(*collections):
+    """Save the given collections (all by default) to their files"""
+    if not persist_data:
+        return
+    pending = getattr(deferred_saves, 'collections', None)
+    if pending is not None:
+        pending.update(collections or all_collections())
+        return
     try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users_db, f, indent=2)
-        with open(CHAT_FILE, 'w') as f:
-            json.dump(chat_messages, f, indent=2)
-        with open(TASKS_FILE, 'w') as f:
-            json.dump(tasks, f, indent=2)
-        with open(AI_CHAT_FILE, 'w') as f:
-            json.dump(ai_chat_history, f, indent=2)
+        for name in collections or all_collections():
+            # Held for the whole write, so two savers never interleave on one file
+            with collection_lock(name):
+                with open(collection_path(name), 'w') as f:
+                    dump_collection(name, f)
     except Exception as e:
         logger.error(f"Failed to save data: {e}")
 
@@ -214,19 +1106,27 @@ def format_help():
 
 AUTHENTICATION:
   register <username> <password>  - register new account
-  login <username> <password>     - login to your account
+  login <username> <password>     - login to your account, prints a resume token
+  resume <token>                  - continue a session on a new connection
   logout                          - logout
 
 CHAT (after login):
-  chat send <message>             - send message to chat
-  chat view                       - view all messages
-  chat view <count>               - view last N messages
+  chat send [#channel] <message>  - send message (to the current channel by default)
+  chat view [#channel]            - view messages
+  chat view [#channel] <count>    - view last N messages
+  chat view [#channel] <count> <cursor> - continue a truncated view
+  chat join <channel>             - create/join a channel: it becomes current, new messages arrive live
+  chat leave [channel]            - stop live messages (current channel by default)
+  chat channels                   - list channels (* = joined)
 
 TASKS (after login):
   task create <title>             - create new task
   task add-desc <task_id>         - add description (multiline, end with 'END')
   task add-sol <task_id>          - add solution (multiline, end with 'END')
+  task append-desc <task_id>      - append to description (multiline, end with 'END')
+  task append-sol <task_id>       - append to solution (multiline, end with 'END')
   task list                       - list all tasks
+  task list <offset>              - continue a truncated list
   task view <task_id>             - view task details
   task status <task_id> <status>  - change status (pending/in_progress/solved)
   task delete <task_id>           - delete task
@@ -235,6 +1135,22 @@ AI CHAT (after login):
   ai <message>                    - chat with AI (Gemini Flash)
   ai clear                        - clear AI chat history
 
+FILES (after login):
+  file list                       - list shared files
+  file upload <name> <size> [off] - upload: after '[OK]' send <size> raw bytes
+                                    (pass the byte count already sent as <off> to resume)
+  file download <name> [offset]   - download: '[OK] <n> bytes, sha256 <hash>' then raw bytes
+  file delete <name>              - delete your file
+
+ADMIN (admins only):
+  admin profile <sec> [sample|cprofile] - profile all connections, report in logs/
+  admin mem stats                 - sizes of chat channels, tasks, AI history, sessions, files
+  admin mem start|snapshot|stop   - tracemalloc snapshots with diffs, report in logs/
+
+BATCH (after login):
+  batch                           - run many commands at once (one per line, end with 'END')
+  batch <json array>              - same, machine mode: ["task create a", ...] -> JSON results
+
 OTHER:
   help                            - show this help
   quit                            - exit
@@ -242,8 +1158,14 @@ OTHER:
 
 
 def generate_session_id():
-    """Generate a new session ID"""
-    return str(uuid.uuid4())
+    """Generate a new session ID (also the client's resume token)"""
+    return secrets.token_urlsafe(32)
+
+
+def touch_session(session_id: str):
+    """Renew an existing session for another SESSION_TTL. Caller must hold the lock."""
+    commit({'type': 'session_touch', 'session_id': session_id,
+            'expires_at': time.time() + SESSION_TTL})
 
 
 def authenticate_user(username: str, password: str) -> Optional[str]:
@@ -256,24 +1178,58 @@ def authenticate_user(username: str, password: str) -> Optional[str]:
             return None
         
         session_id = generate_session_id()
-        sessions[session_id] = username
+        commit({'type': 'session_set', 'session_id': session_id, 'username': username,
+                'expires_at': time.time() + SESSION_TTL})
         return session_id
 
 
+def resume_session(session_id: str) -> Optional[str]:
+    """Renew a live session and return its username, or None if expired/unknown"""
+    with lock:
+        username = sessions.get(session_id)
+        if username is None or username not in users_db:
+            return None
+        touch_session(session_id)
+        return username
+
+
+def session_sweeper():
+    """Background thread: drop expired sessions (every process sweeps its own copy)"""
+    while True:
+        time.sleep(SESSION_SWEEP_INTERVAL)
+        with lock:
+            removed = sessions.sweep()
+        if removed:
+            logger.info(f"[Sessions] Expired {removed} sessions, {len(sessions)} active")
+
+
+def start_sweepers():
+    threading.Thread(target=session_sweeper, daemon=True).start()
+    threading.Thread(target=partial_sweeper, daemon=True).start()
+
+
 def register_user(username: str, password: str) -> bool:
     """Register new user"""
+    if len(username) < 3 or len(password) < 4:
+        return False
+    
     with lock:
         if username in users_db:
             return False
         
-        if len(username) < 3 or len(password) < 4:
+        # The coordinator rejects the name if another worker registered it first
+        reason = commit_ordered({
+            'type': 'user_set',
+            'username': username,
+            'create': True,
+            'user': {
+                'password': hash_password(password),
+                'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+        })
+        if reason:
             return False
-        
-        users_db[username] = {
-            'password': hash_password(password),
-            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        save_data()
+        save_data('users')
         return True
 
 
@@ -305,403 +1261,2037 @@ def get_ai_response(user_message: str, user_history: List[dict]) -> str:
     return gemini_manager.generate_content(gemini_history)
 
 
-def handle_client(client_socket, addr):
-    """Handle client connection"""
-    logger.info(f"Client connected: {addr}")
-    current_user = None
-    session_id = None
-    
-    try:
-        client_socket.send(b"Welcome! Type 'help' for commands\n\n")
-        
+def render_chat_view(channel: Channel, count: int, before: Optional[int] = None) -> bytes:
+    """
+    Render the last `count` messages of `channel` ending before index `before`
+    (end of history by default). At most MAX_CHAT_VIEW messages are
+    rendered; if more were requested a continuation command is appended.
+    """
+    with channel.lock:
+        key = ('chat', channel.name, channel.version, count, before)
+        cached = render_cache.get(key)
+        if cached is not None:
+            return cached
+
+        messages = channel.messages
+        end = len(messages) if before is None else max(0, min(before, len(messages)))
+        wanted = max(0, count)
+        start = max(0, end - min(wanted, MAX_CHAT_VIEW))
+        msgs = messages[start:end]
+
+    if not msgs:
+        data = b"No messages yet\n"
+    else:
+        sep = '=' * 60
+        out = [f"\n{sep}\nChat #{channel.name} ({len(msgs)} messages):\n{sep}\n"]
+        for i, msg in enumerate(msgs, 1):
+            out.append(f"[{i}] {msg.sender} ({format_time(msg.ts)})\n    {msg.text}\n")
+        remaining = min(wanted, end) - len(msgs)
+        if remaining > 0 and start > 0:
+            out.append(f"... {remaining} older messages, continue with: "
+                       f"chat view #{channel.name} {remaining} {start}\n")
+        out.append(f"{sep}\n")
+        data = ''.join(out).encode('utf-8')
+
+    render_cache.put(key, data)
+    return data
+
+
+def render_channel_list(joined) -> bytes:
+    """Channels with message counts; `joined` ones are marked with *"""
+    with channels_lock:
+        listed = sorted(channels.values(), key=lambda c: c.name)
+    out = [f"Channels ({len(listed)}):\n"]
+    for channel in listed:
+        mark = '*' if channel.name in joined else ' '
+        out.append(f" {mark} #{channel.name:<32} {len(channel.messages)} messages\n")
+    return ''.join(out).encode('utf-8')
+
+
+def render_task_list(offset: int = 0) -> bytes:
+    """
+    Render up to MAX_TASK_LIST tasks starting at `offset`.
+    If more tasks follow, a continuation command is appended.
+    """
+    with lock:
+        key = ('tasks', tasks_version, offset)
+        cached = render_cache.get(key)
+        if cached is not None:
+            return cached
+
+        total = len(tasks)
+        offset = max(0, offset)
+        page = list(islice(tasks.items(), offset, offset + MAX_TASK_LIST))
+
+    if not total:
+        data = b"No tasks yet\n"
+    else:
+        sep = '=' * 60
+        out = [f"\n{sep}\nTasks ({total} total):\n{sep}\n"]
+        for task_id, task in page:
+            out.append(f"[{task_id}] {task.title} ({task.status})\n")
+            out.append(f"         by {task.created_by} - {format_time(task.created_at)}\n")
+        next_offset = offset + len(page)
+        if next_offset < total:
+            out.append(f"... {total - next_offset} more, continue with: task list {next_offset}\n")
+        out.append(f"{sep}\n")
+        data = ''.join(out).encode('utf-8')
+
+    render_cache.put(key, data)
+    return data
+
+
+# ==========================================
+# CONNECTIONS & ADMISSION CONTROL
+# ==========================================
+class SlowClientError(Exception):
+    """Client did not read its output within SEND_TIMEOUT"""
+
+
+class LineTooLongError(Exception):
+    """Client sent more than MAX_LINE_LENGTH bytes without a newline"""
+
+
+class HandoffRequested(Exception):
+    """The connection should be passed to the process taking over"""
+
+
+# Set while the connections of this process are being handed to a new process
+handoff_event = threading.Event()
+
+
+class Connection:
+    """
+    Client socket wrapper: newline framing on input, full writes on output.
+    Replies are written by send() and may block up to SEND_TIMEOUT; output
+    from other threads goes through push(), which never blocks and is
+    bounded by OUTPUT_HIGH_WATER.
+    """
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        # Unique across worker processes; tags chat events so the sender gets no echo
+        self.origin = uuid.uuid4().hex
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.send_lock = threading.Lock()
+        # Output queued by other threads (live chat), written between replies
+        self.pushbuf = bytearray()
+        self.push_lock = threading.Lock()
+        self.push_hold = 0   # > 0 during raw transfers, which pushes must not split
+        # With a timeout the socket is non-blocking at the OS level, which push() relies on
+        sock.settimeout(SEND_TIMEOUT)
+
+    def readline(self, timeout: float) -> Optional[str]:
+        """
+        Return the next line without its line ending, or None on EOF.
+        Raises socket.timeout if no full line arrives within `timeout`.
+        """
+        deadline = time.monotonic() + timeout
         while True:
-            data = client_socket.recv(1024).decode('utf-8').strip()
-            
-            if not data:
-                break
+            if handoff_event.is_set():
+                raise HandoffRequested()
             
-            parts = data.split(maxsplit=1)
-            command = parts[0].lower()
+            idx = self.inbuf.find(b'\n')
+            if idx >= 0:
+                line = bytes(self.inbuf[:idx])
+                del self.inbuf[:idx + 1]
+                return line.decode('utf-8', errors='replace').rstrip('\r')
             
-            # Authentication commands (no login required)
-            if command == 'help':
-                client_socket.send(format_help().encode('utf-8') + b'\n')
+            if len(self.inbuf) > MAX_LINE_LENGTH:
+                raise LineTooLongError(f"over {MAX_LINE_LENGTH} bytes without a newline")
             
-            elif command == 'register':
-                if current_user:
-                    client_socket.send(b"[ERR] Already logged in\n")
-                    continue
-                
-                if len(parts) < 2:
-                    client_socket.send(b"Usage: register <username> <password>\n")
-                    continue
-                
-                try:
-                    reg_parts = parts[1].split()
-                    if len(reg_parts) < 2:
-                        client_socket.send(b"Usage: register <username> <password>\n")
-                        continue
-                    
-                    username, password = reg_parts[0], reg_parts[1]
-                    if register_user(username, password):
-                        client_socket.send(f"[OK] User '{username}' registered\n".encode('utf-8'))
-                        logger.info(f"New user registered: {username}")
-                    else:
-                        client_socket.send(b"[ERR] Username taken or invalid\n")
-                except:
-                    client_socket.send(b"[ERR] Invalid format\n")
+            if self.pushbuf:
+                # Pushes that did not fit in the socket buffer earlier
+                self.flush_pushes()
             
-            elif command == 'login':
-                if current_user:
-                    client_socket.send(b"[ERR] Already logged in\n")
-                    continue
-                
-                if len(parts) < 2:
-                    client_socket.send(b"Usage: login <username> <password>\n")
-                    continue
-                
-                try:
-                    login_parts = parts[1].split()
-                    if len(login_parts) < 2:
-                        client_socket.send(b"Usage: login <username> <password>\n")
-                        continue
-                    
-                    username, password = login_parts[0], login_parts[1]
-                    session_id = authenticate_user(username, password)
-                    
-                    if session_id:
-                        current_user = username
-                        client_socket.send(f"[OK] Logged in as '{username}'\n".encode('utf-8'))
-                        logger.info(f"User '{username}' logged in from {addr}")
-                    else:
-                        client_socket.send(b"[ERR] Invalid credentials\n")
-                except:
-                    client_socket.send(b"[ERR] Invalid format\n")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("read timed out")
+            self.sock.settimeout(min(remaining, READ_POLL_INTERVAL))
+            try:
+                chunk = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            if not chunk:
+                if self.inbuf:
+                    # Last line without a trailing newline
+                    line = bytes(self.inbuf)
+                    self.inbuf.clear()
+                    return line.decode('utf-8', errors='replace').rstrip('\r')
+                return None
+            self.inbuf += chunk
+
+    def send(self, data: bytes):
+        """Buffer data and flush everything pending"""
+        with self.send_lock:
+            self.outbuf += data
+            self._flush()
+
+    def flush(self):
+        with self.send_lock:
+            self._flush()
+
+    def _flush(self):
+        # Pending pushes go first: they finish any line a push() started writing
+        pushes = b''
+        if not self.push_hold:
+            with self.push_lock:
+                pushes = bytes(self.pushbuf)
+                self.pushbuf.clear()
+        if not self.outbuf and not pushes:
+            return
+        self.sock.settimeout(SEND_TIMEOUT)
+        try:
+            self.sock.sendall(pushes + self.outbuf)
+        except socket.timeout:
+            raise SlowClientError(f"{len(pushes) + len(self.outbuf)} bytes not read within {SEND_TIMEOUT}s")
+        self.outbuf.clear()
+
+    def push(self, data: bytes) -> bool:
+        """
+        Queue output from another thread without blocking. It is written
+        between replies, never inside one. A client that leaves more than
+        OUTPUT_HIGH_WATER bytes unread is disconnected (returns False).
+        """
+        with self.push_lock:
+            overflow = len(self.pushbuf) + len(data) > OUTPUT_HIGH_WATER
+            if overflow:
+                self.pushbuf.clear()
+            else:
+                self.pushbuf += data
+        if overflow:
+            logger.warning(f"Disconnecting slow client {self.addr}: over {OUTPUT_HIGH_WATER} bytes of output unread")
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return False
+        self.flush_pushes()
+        return True
+
+    def flush_pushes(self):
+        """Write queued pushes as far as the socket takes them, unless a reply is being sent"""
+        if not self.send_lock.acquire(blocking=False):
+            return   # the sender writes them with its reply
+        try:
+            if self.push_hold:
+                return
+            with self.push_lock:
+                if not self.pushbuf:
+                    return
+                try:
+                    written = os.write(self.sock.fileno(), self.pushbuf)
+                except OSError:   # socket buffer full, or the connection is gone
+                    return
+                del self.pushbuf[:written]
+        finally:
+            self.send_lock.release()
+
+    @contextmanager
+    def pushes_held(self):
+        """Keep pushed output out of a raw transfer (file upload/download) until it ends"""
+        with self.send_lock:
+            self._flush()
+            self.push_hold += 1
+        try:
+            yield
+        finally:
+            with self.send_lock:
+                self.push_hold -= 1
+            self.flush_pushes()
+
+    def read_into(self, file, count: int):
+        """Copy exactly `count` raw bytes from the client into `file`"""
+        if self.inbuf:
+            chunk = self.inbuf[:count]
+            file.write(chunk)
+            del self.inbuf[:len(chunk)]
+            count -= len(chunk)
+        
+        buf = memoryview(bytearray(FILE_CHUNK_SIZE))
+        while count > 0:
+            self.sock.settimeout(IDLE_TIMEOUT)
+            n = self.sock.recv_into(buf, min(count, len(buf)))
+            if not n:
+                raise ConnectionResetError("connection closed during transfer")
+            file.write(buf[:n])
+            count -= n
+
+    def sendfile(self, file, offset: int, count: int):
+        """Flush pending output, then send `count` bytes of `file` from `offset` (zero-copy)"""
+        with self.send_lock:
+            self._flush()
+            if count <= 0:
+                return
+            self.sock.settimeout(SEND_TIMEOUT)
+            try:
+                self.sock.sendfile(file, offset, count)
+            except socket.timeout:
+                raise SlowClientError(f"file transfer stalled for {SEND_TIMEOUT}s")
+
+    def close(self):
+        self.sock.close()
+
+
+class AdmissionControl:
+    """Global and per-IP caps on concurrent connections"""
+    def __init__(self, max_total, max_per_ip):
+        self.max_total = max_total
+        self.max_per_ip = max_per_ip
+        self.total = 0
+        self.per_ip: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, ip: str, force: bool = False) -> Optional[str]:
+        """
+        Reserve a slot for `ip`. Returns a rejection reason, or None if admitted.
+        `force` admits regardless of the caps (connections adopted in a handoff).
+        """
+        with self.lock:
+            if not force and self.total >= self.max_total:
+                return "Server is at its connection limit, try again later"
+            if not force and self.per_ip.get(ip, 0) >= self.max_per_ip:
+                return f"Too many connections from your address (max {self.max_per_ip})"
+            self.total += 1
+            self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+            return None
+
+    def release(self, ip: str):
+        with self.lock:
+            self.total -= 1
+            self.per_ip[ip] -= 1
+            if not self.per_ip[ip]:
+                del self.per_ip[ip]
+
+admission = AdmissionControl(MAX_CONNECTIONS, MAX_CONNECTIONS_PER_IP)
+
+
+def reject_client(client_socket, addr, reason: str):
+    """Tell a client why it was not admitted and close the socket"""
+    logger.warning(f"Rejected connection from {addr}: {reason}")
+    try:
+        client_socket.settimeout(1)
+        client_socket.sendall(f"[ERR] {reason}\n".encode('utf-8'))
+    except OSError:
+        pass
+    client_socket.close()
+
+
+# ==========================================
+# RATE LIMITING
+# ==========================================
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`; each command takes one"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 on success, otherwise seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token buckets per (user, command). Commands without a configured
+    limit are not limited. In multi-worker mode the buckets live in the
+    coordinator, so a user's budget is shared by all of their connections.
+    """
+    def __init__(self, limits: Dict[str, dict]):
+        self.limits = limits
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def check(self, username: str, command: str) -> float:
+        """Returns 0 if the command may run, otherwise the retry-after in seconds"""
+        limit = self.limits.get(command)
+        if limit is None:
+            return 0.0
+        if notification_bus.sock is not None:
+            return notification_bus.check_rate(username, command)
+        
+        key = (username, command)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(limit['rate'], limit['burst'])
+            return bucket.take()
+
+    def reload(self, limits: Dict[str, dict]):
+        """Replace the limits; buckets are recreated with the new settings"""
+        with self.lock:
+            self.limits = limits
+            self.buckets = {}
+
+
+def load_rate_limits() -> Dict[str, dict]:
+    """Rate limits from RATE_LIMITS_FILE, falling back to DEFAULT_RATE_LIMITS"""
+    if not os.path.exists(RATE_LIMITS_FILE):
+        return DEFAULT_RATE_LIMITS
+    try:
+        with open(RATE_LIMITS_FILE, 'r') as f:
+            return {
+                command: {'rate': float(limit['rate']), 'burst': float(limit['burst'])}
+                for command, limit in json.load(f).items()
+            }
+    except Exception as e:
+        logger.error(f"Invalid rate limits file {RATE_LIMITS_FILE}: {e}")
+        return DEFAULT_RATE_LIMITS
+
+rate_limiter = RateLimiter(DEFAULT_RATE_LIMITS)
+
+
+def reload_rate_limits(signum=None, frame=None):
+    """SIGHUP handler: re-read the rate limits file"""
+    rate_limiter.reload(load_rate_limits())
+    logger.info(f"Rate limits loaded: {rate_limiter.limits}")
+
+
+# ==========================================
+# MULTILINE TASK UPLOADS
+# ==========================================
+# action: (task field, append instead of replace)
+TASK_UPLOAD_ACTIONS = {
+    'add-desc': ('description', False),
+    'add-sol': ('solution', False),
+    'append-desc': ('description', True),
+    'append-sol': ('solution', True),
+}
+
+
+class TaskUpload:
+    """
+    Multiline task field upload in progress on a connection.
+    Lines are fed one at a time by the connection's read loop until END,
+    so no lock is held and no extra read loop runs while the user types.
+    """
+    def __init__(self, task_id: str, field: str, append: bool):
+        self.task_id = task_id
+        self.field = field
+        self.append = append
+        self.lines: List[str] = []
+        self.size = 0
+        self.overflow = False
+
+    def add(self, line: str) -> Optional[bytes]:
+        """Store a line; returns an acknowledgement to send, if any"""
+        if self.overflow:
+            return None
+        
+        self.size += len(line.encode('utf-8')) + 1
+        if self.size > MAX_UPLOAD_SIZE:
+            self.overflow = True
+            self.lines = []
+            return f"[ERR] {self.field.capitalize()} exceeds {MAX_UPLOAD_SIZE} bytes, discarding until END\n".encode('utf-8')
+        
+        self.lines.append(line)
+        if len(self.lines) % UPLOAD_ACK_LINES == 0:
+            return f"[..] {len(self.lines)} lines ({self.size} bytes) received\n".encode('utf-8')
+        return None
+
+
+def finish_task_upload(upload: TaskUpload, username: str) -> bytes:
+    """Store a completed upload; returns the response for the client"""
+    if upload.overflow:
+        return f"[ERR] {upload.field.capitalize()} too large, not saved\n".encode('utf-8')
+    
+    text = '\n'.join(upload.lines)
+    if upload.append:
+        if not text:
+            return b"[OK] Nothing to append\n"
+        reason = commit_ordered({'type': 'task_append', 'task_id': upload.task_id,
+                                 'field': upload.field, 'text': text})
+    else:
+        reason = commit_ordered({'type': 'task_update', 'task_id': upload.task_id,
+                                 'fields': {upload.field: text}})
+    if reason:
+        return f"[ERR] {reason}\n".encode('utf-8')
+    save_data('tasks')
+    
+    logger.info(f"User '{username}' updated {upload.field} of task {upload.task_id} ({upload.size} bytes)")
+    verb = 'appended' if upload.append else 'saved'
+    return f"[OK] {upload.field.capitalize()} {verb}\n".encode('utf-8')
+
+
+# ==========================================
+# FILE SHARING
+# ==========================================
+def blob_path(sha256: str) -> str:
+    return os.path.join(BLOBS_DIR, sha256)
+
+
+def partial_path(username: str, name: str) -> str:
+    # Usernames are not restricted to safe path characters, so hash them
+    owner = hashlib.sha256(username.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(PARTIAL_DIR, f"{owner}_{name}")
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Uploads being received by this process: {partial path: announced size}
+uploads_in_progress: Dict[str, int] = {}
+
+
+def partial_uploads(username: str) -> Dict[str, int]:
+    """
+    Unfinished uploads of `username` as {partial path: bytes}, counting one
+    in progress here at its announced size. Caller must hold the lock.
+    """
+    prefix = partial_path(username, '')
+    held = {entry.path: entry.stat().st_size for entry in os.scandir(PARTIAL_DIR)
+            if entry.path.startswith(prefix)}
+    for path, size in uploads_in_progress.items():
+        if path.startswith(prefix):
+            held[path] = max(held.get(path, 0), size)
+    return held
+
+
+def quota_used(username: str, exclude: Optional[str] = None) -> int:
+    """
+    Bytes stored by `username`, including unfinished uploads, not counting
+    file `exclude` or its upload. Caller must hold the lock.
+    """
+    stored = sum(f['size'] for name, f in files.items() if f['owner'] == username and name != exclude)
+    partials = partial_uploads(username)
+    if exclude is not None:
+        partials.pop(partial_path(username, exclude), None)
+    return stored + sum(partials.values())
+
+
+def partial_sweeper():
+    """Background thread: delete uploads abandoned for longer than PARTIAL_TTL"""
+    while True:
+        time.sleep(SESSION_SWEEP_INTERVAL)
+        cutoff = time.time() - PARTIAL_TTL
+        with lock:
+            active = set(uploads_in_progress)
+        for entry in os.scandir(PARTIAL_DIR):
+            try:
+                if entry.path not in active and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    logger.info(f"[Files] Deleted abandoned upload {entry.name}")
+            except OSError:
+                pass
+
+
+def remove_blob_if_unused(sha256: str):
+    """Delete a blob no file refers to any more. Caller must hold the lock."""
+    if any(f['sha256'] == sha256 for f in files.values()):
+        return
+    try:
+        os.unlink(blob_path(sha256))
+    except OSError:
+        pass
+
+
+def store_upload(username: str, name: str, partial: str, size: int) -> bytes:
+    """
+    Move a completed upload into the blob store and record it.
+    Hashing runs without the lock; only the rename and manifest update hold it.
+    """
+    sha256 = hash_file(partial)
+    with lock:
+        old = files.get(name)
+        if old and old['owner'] != username:
+            os.unlink(partial)
+            return b"[ERR] File belongs to another user\n"
+        
+        deduplicated = os.path.exists(blob_path(sha256))
+        if deduplicated:
+            os.unlink(partial)
+        else:
+            os.replace(partial, blob_path(sha256))
+        
+        reason = commit_ordered({
+            'type': 'file_set',
+            'name': name,
+            'file': {
+                'sha256': sha256,
+                'size': size,
+                'owner': username,
+                'uploaded_at': format_time(int(time.time()))
+            }
+        })
+        if reason:
+            remove_blob_if_unused(sha256)
+            return f"[ERR] {reason}\n".encode('utf-8')
+        save_data('files')
+        if old and old['sha256'] != sha256:
+            remove_blob_if_unused(old['sha256'])
+    
+    logger.info(f"User '{username}' uploaded {name} ({size} bytes{', deduplicated' if deduplicated else ''})")
+    note = " (deduplicated)" if deduplicated else ""
+    return f"[OK] Uploaded {name}: {size} bytes, sha256 {sha256}{note}\n".encode('utf-8')
+
+
+def render_file_list() -> bytes:
+    with lock:
+        entries = sorted(files.items())
+    
+    if not entries:
+        return b"No files yet\n"
+    
+    sep = '=' * 60
+    out = [f"\n{sep}\nFiles ({len(entries)} total):\n{sep}\n"]
+    for name, f in entries:
+        out.append(f"{name}  ({f['size']} bytes, sha256 {f['sha256'][:12]})\n")
+        out.append(f"         by {f['owner']} - {f['uploaded_at']}\n")
+    out.append(f"{sep}\n")
+    return ''.join(out).encode('utf-8')
+
+
+# ==========================================
+# DIAGNOSTICS
+# ==========================================
+def diagnostics_path(kind: str) -> str:
+    return os.path.join(LOGS_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+
+
+class Profiler:
+    """
+    One profiling run at a time, covering all connection threads.
+    'sample' mode polls the stacks of every thread; 'cprofile' mode runs
+    each command under a per-thread cProfile.Profile and merges the results.
+    Reports are written to LOGS_DIR.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = False
+        self.cprofile_active = False
+        self.profiles = []
+        self.local = threading.local()
+
+    def start(self, seconds: float, mode: str) -> str:
+        """Start a run in the background; returns the report path"""
+        with self.lock:
+            if self.running:
+                raise RuntimeError("a profiling run is already in progress")
+            self.running = True
+        
+        path = diagnostics_path(f"profile-{mode}")
+        target = self._sample if mode == 'sample' else self._cprofile
+        threading.Thread(target=self._run, args=(target, seconds, path), daemon=True).start()
+        return path
+
+    def _run(self, target, seconds, path):
+        try:
+            report = target(seconds)
+            with open(path, 'w') as f:
+                f.write(report)
+            logger.info(f"[Profiler] Report written to {path}")
+        except Exception as e:
+            logger.error(f"[Profiler] Run failed: {e}")
+        finally:
+            with self.lock:
+                self.running = False
+
+    def _sample(self, seconds):
+        own = threading.get_ident()
+        functions: Dict[str, int] = {}
+        stacks: Dict[Tuple[str, ...], int] = {}
+        total = busy = 0
+        deadline = time.monotonic() + seconds
+        
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                total += 1
+                if frame.f_code.co_name in IDLE_FRAMES:
+                    continue
+                busy += 1
+                stack = []
+                seen = set()
+                while frame is not None and len(stack) < 30:
+                    code = frame.f_code
+                    where = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    stack.append(where)
+                    if where not in seen:
+                        seen.add(where)
+                        functions[where] = functions.get(where, 0) + 1
+                    frame = frame.f_back
+                key = tuple(stack)
+                stacks[key] = stacks.get(key, 0) + 1
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+        
+        out = [f"Sampling profile: {seconds}s, {total} thread samples, {busy} busy\n\n",
+               "Functions by inclusive busy samples:\n"]
+        for where, count in sorted(functions.items(), key=lambda i: -i[1])[:40]:
+            out.append(f"{count:8d} {100 * count / max(busy, 1):6.1f}%  {where}\n")
+        out.append("\nHottest stacks (innermost first):\n")
+        for stack, count in sorted(stacks.items(), key=lambda i: -i[1])[:15]:
+            out.append(f"\n{count:8d} samples\n")
+            out.extend(f"    {where}\n" for where in stack)
+        return ''.join(out)
+
+    def _cprofile(self, seconds):
+        import pstats
+        
+        self.profiles = []
+        self.cprofile_active = True
+        time.sleep(seconds)
+        self.cprofile_active = False
+        time.sleep(0.5)   # let in-flight commands finish
+        
+        profiles = [p for p in self.profiles if p.getstats()]
+        if not profiles:
+            return f"cProfile: {seconds}s, no commands were executed\n"
+        stream = io.StringIO()
+        stream.write(f"cProfile: {seconds}s, {len(profiles)} thread profiles\n\n")
+        stats = pstats.Stats(profiles[0], stream=stream)
+        for p in profiles[1:]:
+            stats.add(p)
+        stats.sort_stats('cumulative').print_stats(60)
+        return stream.getvalue()
+
+    def call(self, func, *args):
+        """Run a command, under this thread's cProfile while a cprofile run is active"""
+        if not self.cprofile_active:
+            return func(*args)
+        
+        import cProfile
+        profile = getattr(self.local, 'profile', None)
+        if profile is None or profile not in self.profiles:
+            profile = self.local.profile = cProfile.Profile()
+            self.profiles.append(profile)
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active cProfile at a time; run unprofiled
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+
+profiler = Profiler()
+
+
+def deep_sizeof(obj, seen: set) -> int:
+    """Approximate size of obj and everything it references, counting shared objects once"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+
+def render_memory_stats() -> str:
+    """Item counts and approximate memory of the in-memory collections"""
+    with lock:
+        collections = [
+            ('chat_channels', {name: list(c.messages) for name, c in channels.items()}),
+            ('tasks', dict(tasks)),
+            ('ai_chat_history', dict(ai_chat_history)),
+            ('sessions', dict(sessions.entries)),
+            ('files', dict(files)),
+        ]
+    
+    seen = set()
+    out = [f"{'collection':<16} {'items':>10} {'approx size':>14}\n"]
+    for name, value in collections:
+        size = deep_sizeof(value, seen)
+        out.append(f"{name:<16} {len(value):>10} {size / 1024 / 1024:>10.2f} MiB\n")
+    
+    import resource
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    out.append(f"threads: {threading.active_count()}, peak RSS: {peak_rss:.1f} MiB\n")
+    return ''.join(out)
+
+
+class MemoryTracer:
+    """tracemalloc snapshots with a diff against the previous snapshot"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.previous = None
+
+    def start(self, frames: int = 10):
+        import tracemalloc
+        tracemalloc.start(frames)
+        self.previous = None
+
+    def stop(self):
+        import tracemalloc
+        tracemalloc.stop()
+        self.previous = None
+
+    def snapshot(self) -> Tuple[str, str]:
+        """Write a snapshot report to LOGS_DIR; returns (path, short summary)"""
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracing is off, run 'admin mem start' first")
+        
+        with self.lock:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            previous, self.previous = self.previous, snapshot
+        
+        current, peak = tracemalloc.get_traced_memory()
+        top = snapshot.statistics('lineno')
+        out = [f"Traced memory: {current / 1024 / 1024:.2f} MiB (peak {peak / 1024 / 1024:.2f} MiB)\n\n",
+               "Top allocations by line:\n"]
+        out.extend(f"  {stat}\n" for stat in top[:30])
+        if previous is not None:
+            out.append("\nChanges since previous snapshot:\n")
+            out.extend(f"  {stat}\n" for stat in snapshot.compare_to(previous, 'lineno')[:30])
+        
+        path = diagnostics_path('memory')
+        with open(path, 'w') as f:
+            f.write(''.join(out))
+        
+        summary = ''.join(out[:1] + [f"  {stat}\n" for stat in top[:5]])
+        return path, summary
+
+memory_tracer = MemoryTracer()
+
+
+def dump_diagnostics(signum=None, frame=None):
+    """SIGUSR1 handler: log memory stats and start a sampling profile"""
+    logger.info("[Diagnostics] Memory stats:\n" + render_memory_stats())
+    try:
+        path = profiler.start(SIGNAL_PROFILE_SECONDS, 'sample')
+        logger.info(f"[Diagnostics] Profiling for {SIGNAL_PROFILE_SECONDS}s, report: {path}")
+    except RuntimeError as e:
+        logger.warning(f"[Diagnostics] {e}")
+
+
+# ==========================================
+# BATCHES
+# ==========================================
+class OutputCapture:
+    """Stands in for a Connection to collect the output of one batch item"""
+    def __init__(self, origin: str):
+        self.origin = origin   # of the real connection
+        self.chunks: List[bytes] = []
+
+    def send(self, data: bytes):
+        self.chunks.append(data)
+
+    write = send
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.chunks)
+
+
+def is_upload_command(line: str) -> bool:
+    """True for task commands that read multiline input until END"""
+    words = line.split()
+    return len(words) >= 2 and words[0].lower() == 'task' and words[1].lower() in TASK_UPLOAD_ACTIONS
+
+
+class ClientSession:
+    """
+    Per-connection state and command dispatch.
+    handle_line() runs one input line and writes the response to `self.conn`.
+    """
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.current_user = None
+        self.session_id = None
+        self.session_renewed = 0.0   # monotonic time of the last renewal by this connection
+        self.login_deadline = time.monotonic() + LOGIN_TIMEOUT
+        self.upload = None
+        self.batch_items: Optional[List[List[str]]] = None   # text-mode batch being collected
+        self.batch_upload_open = False
+        self.batch_overflow = False
+        self.in_batch = False
+        self.channel = DEFAULT_CHANNEL   # target of chat send/view without #channel
+        self.joined: set = set()          # channels this connection is subscribed to
+
+    def leave_channels(self):
+        for name in self.joined:
+            channel = channels.get(name)
+            if channel is not None:
+                channel.unsubscribe(self.conn)
+        self.joined = set()
+        self.channel = DEFAULT_CHANNEL
+
+    def split_channel(self, args: str) -> Tuple[str, str]:
+        """Split an optional leading '#channel' off `args`: (channel name, rest)"""
+        if args.startswith('#'):
+            first, _, rest = args.partition(' ')
+            return first[1:].lower(), rest.strip()
+        return self.channel, args
+
+    def export_state(self) -> dict:
+        """Session state to carry over a handoff (taken at a command boundary)"""
+        upload = None
+        if self.upload:
+            upload = {
+                'task_id': self.upload.task_id,
+                'field': self.upload.field,
+                'append': self.upload.append,
+                'lines': self.upload.lines,
+                'size': self.upload.size,
+                'overflow': self.upload.overflow,
+            }
+        return {
+            'current_user': self.current_user,
+            'session_id': self.session_id,
+            'login_remaining': self.login_deadline - time.monotonic(),
+            'upload': upload,
+            'batch_items': self.batch_items,
+            'batch_upload_open': self.batch_upload_open,
+            'batch_overflow': self.batch_overflow,
+            'channel': self.channel,
+            'joined': sorted(self.joined),
+        }
+
+    def import_state(self, state: dict):
+        self.current_user = state['current_user']
+        self.session_id = state['session_id']
+        self.login_deadline = time.monotonic() + state['login_remaining']
+        if state['upload']:
+            u = state['upload']
+            self.upload = TaskUpload(u['task_id'], u['field'], u['append'])
+            self.upload.lines = u['lines']
+            self.upload.size = u['size']
+            self.upload.overflow = u['overflow']
+        self.batch_items = state['batch_items']
+        self.batch_upload_open = state['batch_upload_open']
+        self.batch_overflow = state['batch_overflow']
+        self.channel = state.get('channel', DEFAULT_CHANNEL)
+        for name in state.get('joined', []):
+            channel = channels.get(name)
+            if channel is not None:
+                channel.subscribe(self.conn, self.current_user)
+                self.joined.add(name)
+
+    def renew_session(self):
+        """Keep the session of a busy connection from expiring under it"""
+        now = time.monotonic()
+        if now - self.session_renewed < SESSION_RENEW_INTERVAL:
+            return
+        self.session_renewed = now
+        with lock:
+            if self.session_id in sessions:
+                touch_session(self.session_id)
+
+    def handle_line(self, line: str) -> bool:
+        """Run one input line. Returns False when the connection should be closed."""
+        if self.session_id:
+            self.renew_session()
+        
+        # Lines of a multiline upload are content, not commands
+        if self.upload:
+            if line == 'END':
+                self.conn.send(finish_task_upload(self.upload, self.current_user))
+                self.upload = None
+            else:
+                ack = self.upload.add(line)
+                if ack:
+                    self.conn.send(ack)
+            return True
+        
+        if self.batch_items is not None:
+            self.collect_batch_line(line)
+            return True
+        
+        data = line.strip()
+        if not data:
+            return True
+        
+        parts = data.split(maxsplit=1)
+        command = parts[0].lower()
+        
+        if self.current_user and not self.in_batch:
+            retry_after = rate_limiter.check(self.current_user, command)
+            if retry_after:
+                self.conn.send(f"[ERR] Rate limit exceeded for '{command}', retry after {retry_after:.1f}s\n".encode('utf-8'))
+                return True
+        
+        # Authentication commands (no login required)
+        if command == 'help':
+            self.conn.send(format_help().encode('utf-8') + b'\n')
+        
+        elif command == 'register':
+            if self.current_user:
+                self.conn.send(b"[ERR] Already logged in\n")
+                return True
             
-            # Commands requiring login
-            elif not current_user:
-                client_socket.send(b"[ERR] Please login first\n")
+            if len(parts) < 2:
+                self.conn.send(b"Usage: register <username> <password>\n")
+                return True
             
-            elif command == 'logout':
-                if session_id:
-                    with lock:
-                        if session_id in sessions:
-                            del sessions[session_id]
-                current_user = None
-                session_id = None
-                client_socket.send(b"[OK] Logged out\n")
-            
-            # CHAT commands
-            elif command == 'chat':
-                if len(parts) < 2:
-                    client_socket.send(b"Usage: chat send <message> | chat view [count]\n")
-                    continue
+            try:
+                reg_parts = parts[1].split()
+                if len(reg_parts) < 2:
+                    self.conn.send(b"Usage: register <username> <password>\n")
+                    return True
                 
-                action_parts = parts[1].split(maxsplit=1)
-                action = action_parts[0].lower()
+                username, password = reg_parts[0], reg_parts[1]
+                if register_user(username, password):
+                    self.conn.send(f"[OK] User '{username}' registered\n".encode('utf-8'))
+                    logger.info(f"New user registered: {username}")
+                else:
+                    self.conn.send(b"[ERR] Username taken or invalid\n")
+            except:
+                self.conn.send(b"[ERR] Invalid format\n")
+        
+        elif command == 'login':
+            if self.current_user:
+                self.conn.send(b"[ERR] Already logged in\n")
+                return True
+            
+            if len(parts) < 2:
+                self.conn.send(b"Usage: login <username> <password>\n")
+                return True
+            
+            try:
+                login_parts = parts[1].split()
+                if len(login_parts) < 2:
+                    self.conn.send(b"Usage: login <username> <password>\n")
+                    return True
                 
-                if action == 'send':
-                    if len(action_parts) < 2:
-                        client_socket.send(b"[ERR] Empty message\n")
-                        continue
-
-                    
-                    message_text = action_parts[1]
-                    
-                    with lock:
-                        msg_obj = {
-                            'from': current_user,
-                            'text': message_text,
-                            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        }
-                        chat_messages.append(msg_obj)
-                        save_data()
-                    
-                    client_socket.send(b"[OK] Message sent\n")
-                    logger.info(f"User '{current_user}' sent chat message")
+                username, password = login_parts[0], login_parts[1]
+                self.session_id = authenticate_user(username, password)
                 
-                elif action == 'view':
-                    count = 100
-                    if len(action_parts) > 1:
-                        try:
-                            count = int(action_parts[1])
-                        except:
-                            pass
-                    
-                    with lock:
-                        msgs = list(chat_messages[-count:])
-                    
-                    if not msgs:
-                        client_socket.send(b"No messages yet\n")
-                    else:
-                        response = f"\n{'='*60}\nChat ({len(msgs)} messages):\n{'='*60}\n"
-                        for i, msg in enumerate(msgs, 1):
-                            response += f"[{i}] {msg['from']} ({msg['time']})\n    {msg['text']}\n"
-                        response += f"{'='*60}\n"
-                        client_socket.send(response.encode('utf-8'))
+                if self.session_id:
+                    self.current_user = username
+                    self.session_renewed = time.monotonic()
+                    self.conn.send(f"[OK] Logged in as '{username}', resume token: {self.session_id}\n".encode('utf-8'))
+                    logger.info(f"User '{username}' logged in from {self.addr}")
                 else:
-                    client_socket.send(b"[ERR] Unknown chat action\n")
+                    self.conn.send(b"[ERR] Invalid credentials\n")
+            except:
+                self.conn.send(b"[ERR] Invalid format\n")
+        
+        elif command == 'resume':
+            if self.current_user:
+                self.conn.send(b"[ERR] Already logged in\n")
+                return True
             
-            # TASK commands
-            elif command == 'task':
-                if len(parts) < 2:
-                    client_socket.send(b"Usage: task create <title> | task view <id> | task list | task status <id> <status>\n")
-                    continue
-                
-                action_parts = parts[1].split(maxsplit=1)
-                action = action_parts[0].lower()
+            if len(parts) < 2:
+                self.conn.send(b"Usage: resume <token>\n")
+                return True
+            
+            token = parts[1].strip()
+            username = resume_session(token)
+            if username:
+                self.current_user = username
+                self.session_id = token
+                self.session_renewed = time.monotonic()
+                self.conn.send(f"[OK] Resumed session as '{username}'\n".encode('utf-8'))
+                logger.info(f"User '{username}' resumed session from {self.addr}")
+            else:
+                self.conn.send(b"[ERR] Invalid or expired token\n")
+        
+        # Commands requiring login
+        elif not self.current_user:
+            self.conn.send(b"[ERR] Please login first\n")
+        
+        elif command == 'logout':
+            if self.session_id:
+                with lock:
+                    if self.session_id in sessions:
+                        commit({'type': 'session_del', 'session_id': self.session_id})
+            self.leave_channels()
+            self.current_user = None
+            self.session_id = None
+            self.login_deadline = time.monotonic() + LOGIN_TIMEOUT
+            self.conn.send(b"[OK] Logged out\n")
+        
+        # CHAT commands
+        elif command == 'chat':
+            if len(parts) < 2:
+                self.conn.send(b"Usage: chat send [#channel] <message> | chat view [#channel] [count] | "
+                               b"chat join <channel> | chat leave [channel] | chat channels\n")
+                return True
+            
+            action_parts = parts[1].split(maxsplit=1)
+            action = action_parts[0].lower()
+            args = action_parts[1] if len(action_parts) > 1 else ''
+            
+            if action in ('send', 'view'):
+                name, args = self.split_channel(args)
+                channel = channels.get(name)
+                if channel is None:
+                    self.conn.send(f"[ERR] No channel #{name}, create it with: chat join {name}\n".encode('utf-8'))
+                    return True
+            
+            if action == 'send':
+                if not args:
+                    self.conn.send(b"[ERR] Empty message\n")
+                    return True
                 
-                if action == 'create':
-                    if len(action_parts) < 2:
-                        client_socket.send(b"[ERR] Title required\n")
-                        continue
-                    
-                    title = action_parts[1]
-                    task_id = str(uuid.uuid4())[:8]
-                    
-                    with lock:
-                        tasks[task_id] = {
-                            'title': title,
-                            'description': '',
-                            'solution': '',
-                            'status': 'pending',
-                            'created_by': current_user,
-                            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        }
-                        save_data()
-                    
-                    client_socket.send(f"[OK] Task created: {task_id}\n".encode('utf-8'))
-                    logger.info(f"User '{current_user}' created task {task_id}")
+                # Appends lock only their own channel: other channels and commands proceed meanwhile
+                msg_obj = ChatMessage(self.current_user, args, int(time.time()))
+                commit_ordered({'type': 'chat_append', 'channel': channel.name,
+                                'message': msg_obj.to_dict(), 'origin': self.conn.origin})
+                save_data(channel_collection(channel.name))
                 
-                elif action == 'list':
-                    with lock:
-                        task_list = list(tasks.items())
-                    
-                    if not task_list:
-                        client_socket.send(b"No tasks yet\n")
-                    else:
-                        response = f"\n{'='*60}\nTasks ({len(task_list)} total):\n{'='*60}\n"
-                        for task_id, task in task_list:
-                            response += f"[{task_id}] {task['title']} ({task['status']})\n"
-                            response += f"         by {task['created_by']} - {task['created_at']}\n"
-                        response += f"{'='*60}\n"
-                        client_socket.send(response.encode('utf-8'))
-                
-                elif action == 'view':
-                    try:
-                        view_parts = action_parts[1].split()
-                        task_id = view_parts[0]
-                    except:
-                        client_socket.send(b"Usage: task view <task_id>\n")
-                        continue
-
-                    
-                    with lock:
-                        task = tasks.get(task_id)
-                    
-                    if not task:
-                        client_socket.send(b"[ERR] Task not found\n")
-                    else:
-                        response = f"\n{'='*60}\nTask: {task_id}\n{'='*60}\n"
-                        response += f"Title:       {task['title']}\n"
-                        response += f"Status:      {task['status']}\n"
-                        response += f"Created by:  {task['created_by']}\n"
-                        response += f"Created at:  {task['created_at']}\n"
-                        response += f"\nDescription:\n{task['description'] or '(none)'}\n"
-                        response += f"\nSolution:\n{task['solution'] or '(none)'}\n"
-                        response += f"{'='*60}\n"
-                        client_socket.send(response.encode('utf-8'))
-                
-                elif action == 'add-desc':
+                self.conn.send(b"[OK] Message sent\n")
+                logger.info(f"User '{self.current_user}' sent chat message to #{channel.name}")
+            
+            elif action == 'view':
+                count = DEFAULT_CHAT_VIEW
+                before = None
+                if args:
+                    view_args = args.split()
                     try:
-                        desc_parts = action_parts[1].split()
-                        task_id = desc_parts[0]
+                        count = int(view_args[0])
+                        if len(view_args) > 1:
+                            before = int(view_args[1])
                     except:
-                        client_socket.send(b"Usage: task add-desc <task_id>\n")
-                        continue
-                    
-                    with lock:
-                        if task_id not in tasks:
-                            client_socket.send(b"[ERR] Task not found\n")
-                            continue
-                    
-                    client_socket.send(b"Enter description (type 'END' on new line to finish):\n")
-                    
-                    desc_lines = []
-                    while True:
-                        try:
-                            line = client_socket.recv(1024).decode('utf-8').rstrip('\n\r')
-                            if line == 'END':
-                                break
-                            desc_lines.append(line)
-                        except:
-                            break
-                    
-                    description = '\n'.join(desc_lines)
-                    
-                    with lock:
-                        if task_id in tasks:
-                            tasks[task_id]['description'] = description
-                            save_data()
-                    
-                    client_socket.send(b"[OK] Description saved\n")
+                        pass
+                if count <= 0:
+                    count = DEFAULT_CHAT_VIEW
+                if before is not None and before < 0:
+                    before = None
+                
+                self.conn.send(render_chat_view(channel, count, before))
+            
+            elif action == 'join':
+                name = args.lstrip('#').lower()
+                if not CHANNEL_NAME_RE.match(name):
+                    self.conn.send(b"[ERR] Channel name: 1-32 of a-z, 0-9, '_' and '-'\n")
+                    return True
+                if self.in_batch:
+                    self.conn.send(b"[ERR] chat join is not allowed in batch\n")
+                    return True
+                
+                if name not in channels:
+                    reason = commit_ordered({'type': 'channel_create', 'channel': name})
+                    if reason:
+                        self.conn.send(f"[ERR] {reason}\n".encode('utf-8'))
+                        return True
+                    save_data(channel_collection(name))
+                    logger.info(f"User '{self.current_user}' joined new channel #{name}")
+                
+                channels[name].subscribe(self.conn, self.current_user)
+                self.joined.add(name)
+                self.channel = name
+                self.conn.send(f"[OK] Joined #{name}\n".encode('utf-8'))
+            
+            elif action == 'leave':
+                name = args.lstrip('#').lower() or self.channel
+                if name not in self.joined:
+                    self.conn.send(f"[ERR] Not joined to #{name}\n".encode('utf-8'))
+                    return True
+                channel = channels.get(name)
+                if channel is not None:
+                    channel.unsubscribe(self.conn)
+                self.joined.discard(name)
+                if self.channel == name:
+                    self.channel = DEFAULT_CHANNEL
+                self.conn.send(f"[OK] Left #{name}\n".encode('utf-8'))
+            
+            elif action == 'channels':
+                self.conn.send(render_channel_list(self.joined))
+            else:
+                self.conn.send(b"[ERR] Unknown chat action\n")
+        
+        # TASK commands
+        elif command == 'task':
+            if len(parts) < 2:
+                self.conn.send(b"Usage: task create <title> | task view <id> | task list | task status <id> <status>\n")
+                return True
+            
+            action_parts = parts[1].split(maxsplit=1)
+            action = action_parts[0].lower()
+            
+            if action == 'create':
+                if len(action_parts) < 2:
+                    self.conn.send(b"[ERR] Title required\n")
+                    return True
+                
+                title = action_parts[1]
+                task_id = str(uuid.uuid4())[:8]
                 
-                elif action == 'add-sol':
+                reason = commit_ordered({
+                    'type': 'task_set',
+                    'task_id': task_id,
+                    'task': Task(title, '', '', 'pending', self.current_user, int(time.time())).to_dict()
+                })
+                if reason:
+                    self.conn.send(f"[ERR] {reason}\n".encode('utf-8'))
+                    return True
+                save_data('tasks')
+                
+                self.conn.send(f"[OK] Task created: {task_id}\n".encode('utf-8'))
+                logger.info(f"User '{self.current_user}' created task {task_id}")
+            
+            elif action == 'list':
+                offset = 0
+                if len(action_parts) > 1:
                     try:
-                        sol_parts = action_parts[1].split()
-                        task_id = sol_parts[0]
+                        offset = int(action_parts[1].split()[0])
                     except:
-                        client_socket.send(b"Usage: task add-sol <task_id>\n")
-                        continue
-                    
-                    with lock:
-                        if task_id not in tasks:
-                            client_socket.send(b"[ERR] Task not found\n")
-                            continue
-                    
-                    client_socket.send(b"Enter solution (type 'END' on new line to finish):\n")
-                    
-                    sol_lines = []
-                    while True:
-                        try:
-                            line = client_socket.recv(1024).decode('utf-8').rstrip('\n\r')
-                            if line == 'END':
-                                break
-                            sol_lines.append(line)
-                        except:
-                            break
-                    
-                    solution = '\n'.join(sol_lines)
-                    
-                    with lock:
-                        if task_id in tasks:
-                            tasks[task_id]['solution'] = solution
-                            save_data()
-                    
-                    client_socket.send(b"[OK] Solution saved\n")
+                        pass
                 
-                elif action == 'status':
-                    try:
-                        status_parts = action_parts[1].split()
-                        task_id = status_parts[0]
-                        new_status = status_parts[1] if len(status_parts) > 1 else None
+                self.conn.send(render_task_list(offset))
+            
+            elif action == 'view':
+                try:
+                    view_parts = action_parts[1].split()
+                    task_id = view_parts[0]
+                except:
+                    self.conn.send(b"Usage: task view <task_id>\n")
+                    return True
 
-                    except:
-                        client_socket.send(b"Usage: task status <task_id> <status>\n")
-                        continue
-                    
-                    if new_status not in ['pending', 'in_progress', 'solved']:
-                        client_socket.send(b"[ERR] Status must be: pending, in_progress, or solved\n")
-                        continue
-                    
-                    with lock:
-                        if task_id not in tasks:
-                            client_socket.send(b"[ERR] Task not found\n")
-                        else:
-                            tasks[task_id]['status'] = new_status
-                            save_data()
-                            client_socket.send(f"[OK] Status changed to '{new_status}'\n".encode('utf-8'))
-                
-                elif action == 'delete':
-                    try:
-                        del_parts = action_parts[1].split()
-                        task_id = del_parts[0]
-                    except:
-                        client_socket.send(b"Usage: task delete <task_id>\n")
-                        continue
-                    
-                    with lock:
-                        if task_id in tasks:
-                            del tasks[task_id]
-                            save_data()
-                            client_socket.send(b"[OK] Task deleted\n")
-                        else:
-                            client_socket.send(b"[ERR] Task not found\n")
+                
+                with lock:
+                    task = tasks.get(task_id)
+                
+                if not task:
+                    self.conn.send(b"[ERR] Task not found\n")
                 else:
-                    client_socket.send(b"[ERR] Unknown task action\n")
+                    response = f"\n{'='*60}\nTask: {task_id}\n{'='*60}\n"
+                    response += f"Title:       {task.title}\n"
+                    response += f"Status:      {task.status}\n"
+                    response += f"Created by:  {task.created_by}\n"
+                    response += f"Created at:  {format_time(task.created_at)}\n"
+                    response += f"\nDescription:\n{task.description or '(none)'}\n"
+                    response += f"\nSolution:\n{task.solution or '(none)'}\n"
+                    response += f"{'='*60}\n"
+                    self.conn.send(response.encode('utf-8'))
             
-            # AI CHAT commands
-            elif command == 'ai':
-                if len(parts) < 2:
-                    client_socket.send(b"Usage: ai <message> | ai clear\n")
-                    continue
+            elif action in TASK_UPLOAD_ACTIONS:
+                try:
+                    upload_parts = action_parts[1].split()
+                    task_id = upload_parts[0]
+                except:
+                    self.conn.send(f"Usage: task {action} <task_id>\n".encode('utf-8'))
+                    return True
                 
-                ai_input = parts[1].lower()
+                with lock:
+                    if task_id not in tasks:
+                        self.conn.send(b"[ERR] Task not found\n")
+                        return True
                 
-                if ai_input == 'clear':
-                    with lock:
-                        if current_user in ai_chat_history:
-                            ai_chat_history[current_user] = []
-                            save_data()
-                    client_socket.send(b"[OK] AI chat history cleared\n")
+                field, append = TASK_UPLOAD_ACTIONS[action]
+                self.upload = TaskUpload(task_id, field, append)
+                self.conn.send(f"Enter {field} (type 'END' on new line to finish):\n".encode('utf-8'))
+            
+            elif action == 'status':
+                try:
+                    status_parts = action_parts[1].split()
+                    task_id = status_parts[0]
+                    new_status = status_parts[1] if len(status_parts) > 1 else None
+
+                except:
+                    self.conn.send(b"Usage: task status <task_id> <status>\n")
+                    return True
+                
+                if new_status not in ['pending', 'in_progress', 'solved']:
+                    self.conn.send(b"[ERR] Status must be: pending, in_progress, or solved\n")
+                    return True
+                
+                reason = commit_ordered({'type': 'task_update', 'task_id': task_id,
+                                         'fields': {'status': new_status}})
+                if reason:
+                    self.conn.send(f"[ERR] {reason}\n".encode('utf-8'))
                 else:
-                    message = parts[1]
-                    
-                    with lock:
-                        if current_user not in ai_chat_history:
-                            ai_chat_history[current_user] = []
+                    save_data('tasks')
+                    self.conn.send(f"[OK] Status changed to '{new_status}'\n".encode('utf-8'))
+            
+            elif action == 'delete':
+                try:
+                    del_parts = action_parts[1].split()
+                    task_id = del_parts[0]
+                except:
+                    self.conn.send(b"Usage: task delete <task_id>\n")
+                    return True
+                
+                reason = commit_ordered({'type': 'task_del', 'task_id': task_id})
+                if reason:
+                    self.conn.send(f"[ERR] {reason}\n".encode('utf-8'))
+                else:
+                    save_data('tasks')
+                    self.conn.send(b"[OK] Task deleted\n")
+            else:
+                self.conn.send(b"[ERR] Unknown task action\n")
+        
+        # AI CHAT commands
+        elif command == 'ai':
+            if len(parts) < 2:
+                self.conn.send(b"Usage: ai <message> | ai clear\n")
+                return True
+            
+            ai_input = parts[1].lower()
+            
+            if ai_input == 'clear':
+                if self.current_user in ai_chat_history:
+                    commit_ordered({'type': 'ai_clear', 'username': self.current_user})
+                    save_data('ai_chat')
+                self.conn.send(b"[OK] AI chat history cleared\n")
+            else:
+                message = parts[1]
+                
+                commit_ordered({
+                    'type': 'ai_append',
+                    'username': self.current_user,
+                    'message': {'role': 'user', 'content': message}
+                })
+                with lock:
+                    user_history = list(ai_chat_history.get(self.current_user, []))
+                
+                # Get response from Gemini via Manager
+                response_text = get_ai_response(message, user_history)
+                
+                commit_ordered({
+                    'type': 'ai_append',
+                    'username': self.current_user,
+                    'message': {'role': 'assistant', 'content': response_text}
+                })
+                save_data('ai_chat')
+                
+                self.conn.send(f"AI: {response_text}\n".encode('utf-8'))
+                logger.info(f"User '{self.current_user}' sent AI message")
+        
+        # FILE commands
+        elif command == 'file':
+            if len(parts) < 2:
+                self.conn.send(b"Usage: file list | file upload <name> <size> [offset] | file download <name> [offset] | file delete <name>\n")
+                return True
+            
+            action_parts = parts[1].split()
+            action = action_parts[0].lower()
+            
+            if action == 'list':
+                self.conn.send(render_file_list())
+            
+            elif action == 'upload':
+                try:
+                    name = action_parts[1]
+                    size = int(action_parts[2])
+                    offset = int(action_parts[3]) if len(action_parts) > 3 else 0
+                except:
+                    self.conn.send(b"Usage: file upload <name> <size> [offset]\n")
+                    return True
+                
+                if not FILE_NAME_RE.match(name):
+                    self.conn.send(b"[ERR] Invalid file name (letters, digits, '.', '_', '-'; max 128)\n")
+                    return True
+                if size < 0 or size > MAX_FILE_SIZE:
+                    self.conn.send(f"[ERR] File size must be 0..{MAX_FILE_SIZE} bytes\n".encode('utf-8'))
+                    return True
+                
+                partial = partial_path(self.current_user, name)
+                with lock:
+                    existing = files.get(name)
+                    if existing and existing['owner'] != self.current_user:
+                        self.conn.send(b"[ERR] File belongs to another user\n")
+                        return True
+                    if partial in uploads_in_progress:
+                        self.conn.send(f"[ERR] Upload of {name} already in progress\n".encode('utf-8'))
+                        return True
+                    partials = partial_uploads(self.current_user)
+                    partials.pop(partial, None)
+                    if len(partials) >= MAX_PARTIAL_UPLOADS:
+                        self.conn.send(f"[ERR] Too many unfinished uploads (max {MAX_PARTIAL_UPLOADS}), "
+                                       f"finish or restart one of them\n".encode('utf-8'))
+                        return True
+                    if quota_used(self.current_user, exclude=name) + size > USER_FILE_QUOTA:
+                        self.conn.send(f"[ERR] Quota of {USER_FILE_QUOTA} bytes exceeded\n".encode('utf-8'))
+                        return True
+                    uploads_in_progress[partial] = size
+                
+                try:
+                    # An interrupted upload stays in PARTIAL_DIR for resuming until PARTIAL_TTL
+                    with open(partial, 'a+b') as f:
+                        try:
+                            # Other worker processes don't see uploads_in_progress
+                            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except OSError:
+                            self.conn.send(f"[ERR] Upload of {name} already in progress\n".encode('utf-8'))
+                            return True
+                        received = f.seek(0, os.SEEK_END)
+                        if offset and (offset != received or offset > size):
+                            if not received:
+                                os.unlink(partial)   # created by the open above
+                            self.conn.send(f"[ERR] Cannot resume at {offset}, {received} bytes received so far\n".encode('utf-8'))
+                            return True
                         
-                        ai_chat_history[current_user].append({
-                            'role': 'user',
-                            'content': message
-                        })
-                        user_history = list(ai_chat_history[current_user])
-                    
-                    # Get response from Gemini via Manager
-                    response_text = get_ai_response(message, user_history)
-                    
+                        with self.conn.pushes_held():
+                            self.conn.send(f"[OK] Send {size - offset} bytes\n".encode('utf-8'))
+                            # Written without the lock
+                            f.truncate(offset)
+                            f.seek(offset)
+                            self.conn.read_into(f, size - offset)
+                            f.flush()
+                            self.conn.send(store_upload(self.current_user, name, partial, size))
+                finally:
                     with lock:
-                        if current_user in ai_chat_history:
-                            ai_chat_history[current_user].append({
-                                'role': 'assistant',
-                                'content': response_text
-                            })
-                            save_data()
+                        uploads_in_progress.pop(partial, None)
+            
+            elif action == 'download':
+                try:
+                    name = action_parts[1]
+                    offset = int(action_parts[2]) if len(action_parts) > 2 else 0
+                except:
+                    self.conn.send(b"Usage: file download <name> [offset]\n")
+                    return True
+                
+                with lock:
+                    entry = files.get(name)
+                
+                if not entry:
+                    self.conn.send(b"[ERR] File not found\n")
+                    return True
+                try:
+                    blob = open(blob_path(entry['sha256']), 'rb')
+                except OSError:
+                    self.conn.send(b"[ERR] File data missing\n")
+                    return True
+                
+                with blob, self.conn.pushes_held():
+                    offset = max(0, min(offset, entry['size']))
+                    count = entry['size'] - offset
+                    self.conn.send(f"[OK] {count} bytes, sha256 {entry['sha256']}\n".encode('utf-8'))
+                    self.conn.sendfile(blob, offset, count)
+                
+                logger.info(f"User '{self.current_user}' downloaded {name} ({count} bytes)")
+            
+            elif action == 'delete':
+                try:
+                    name = action_parts[1]
+                except:
+                    self.conn.send(b"Usage: file delete <name>\n")
+                    return True
+                
+                with lock:
+                    entry = files.get(name)
+                    if not entry:
+                        self.conn.send(b"[ERR] File not found\n")
+                        return True
+                    if entry['owner'] != self.current_user:
+                        self.conn.send(b"[ERR] File belongs to another user\n")
+                        return True
+                    commit({'type': 'file_del', 'name': name})
+                    save_data('files')
+                    remove_blob_if_unused(entry['sha256'])
+                
+                self.conn.send(b"[OK] File deleted\n")
+                logger.info(f"User '{self.current_user}' deleted file {name}")
+            
+            else:
+                self.conn.send(b"[ERR] Unknown file action\n")
+        
+        # ADMIN commands
+        elif command == 'admin':
+            if self.current_user not in ADMIN_USERS:
+                self.conn.send(b"[ERR] Admin only\n")
+                return True
+            
+            admin_parts = parts[1].split() if len(parts) > 1 else []
+            action = admin_parts[0].lower() if admin_parts else ''
+            
+            if action == 'profile':
+                try:
+                    seconds = float(admin_parts[1])
+                    mode = admin_parts[2].lower() if len(admin_parts) > 2 else 'sample'
+                    if not 0 < seconds <= MAX_PROFILE_SECONDS or mode not in ('sample', 'cprofile'):
+                        raise ValueError
+                except:
+                    self.conn.send(f"Usage: admin profile <seconds 1-{MAX_PROFILE_SECONDS}> [sample|cprofile]\n".encode('utf-8'))
+                    return True
+                try:
+                    path = profiler.start(seconds, mode)
+                except RuntimeError as e:
+                    self.conn.send(f"[ERR] {e}\n".encode('utf-8'))
+                    return True
+                self.conn.send(f"[OK] Profiling ({mode}) for {seconds:g}s, report: {path}\n".encode('utf-8'))
+                logger.info(f"Admin '{self.current_user}' started {mode} profiling for {seconds:g}s")
+            
+            elif action == 'mem':
+                mem_action = admin_parts[1].lower() if len(admin_parts) > 1 else ''
+                if mem_action == 'stats':
+                    self.conn.send(render_memory_stats().encode('utf-8'))
+                elif mem_action == 'start':
+                    memory_tracer.start()
+                    self.conn.send(b"[OK] tracemalloc started\n")
+                elif mem_action == 'stop':
+                    memory_tracer.stop()
+                    self.conn.send(b"[OK] tracemalloc stopped\n")
+                elif mem_action == 'snapshot':
+                    try:
+                        path, summary = memory_tracer.snapshot()
+                    except RuntimeError as e:
+                        self.conn.send(f"[ERR] {e}\n".encode('utf-8'))
+                        return True
+                    self.conn.send(f"{summary}[OK] Full report: {path}\n".encode('utf-8'))
+                else:
+                    self.conn.send(b"Usage: admin mem stats | start | snapshot | stop\n")
+            
+            else:
+                self.conn.send(b"Usage: admin profile <seconds> [sample|cprofile] | admin mem stats|start|snapshot|stop\n")
+        
+        # BATCH commands
+        elif command == 'batch':
+            if len(parts) < 2:
+                self.batch_items = []
+                self.batch_upload_open = False
+                self.batch_overflow = False
+                self.conn.send(b"Enter commands (type 'END' on new line to finish):\n")
+                return True
+            
+            try:
+                commands = json.loads(parts[1])
+                if not isinstance(commands, list) or not all(isinstance(c, str) for c in commands):
+                    raise ValueError("expected a JSON array of strings")
+            except ValueError as e:
+                self.conn.send(f"[ERR] Invalid batch: {e}\n".encode('utf-8'))
+                return True
+            
+            # Machine mode: an element may hold a multiline upload, lines separated by \n
+            self.conn.send(self.run_batch([c.split('\n') for c in commands], as_json=True))
+        
+        elif command == 'quit' or command == 'exit':
+            self.conn.send(b"Goodbye!\n")
+            return False
+        
+        else:
+            self.conn.send(b"[ERR] Unknown command. Type 'help' for commands\n")
+        
+        return True
+
+    def collect_batch_line(self, line: str):
+        """Collect a text-mode batch line; END (outside an upload) runs the batch"""
+        if self.batch_upload_open:
+            self.batch_items[-1].append(line)
+            if line == 'END':
+                self.batch_upload_open = False
+        elif line.strip() == 'END':
+            items, self.batch_items = self.batch_items, None
+            if self.batch_overflow:
+                self.conn.send(f"[ERR] Batch exceeds {MAX_BATCH_COMMANDS} commands, nothing executed\n".encode('utf-8'))
+            else:
+                self.conn.send(self.run_batch(items, as_json=False))
+        elif line.strip():
+            if len(self.batch_items) >= MAX_BATCH_COMMANDS:
+                self.batch_overflow = True
+                return
+            self.batch_items.append([line])
+            self.batch_upload_open = is_upload_command(line)
+
+    def run_batch(self, items: List[List[str]], as_json: bool) -> bytes:
+        """
+        Run batch items (a command line plus any upload lines) under a single
+        lock acquisition, writing changed data files once at the end.
+        Items are isolated from other clients but not rolled back on error.
+        """
+        if len(items) > MAX_BATCH_COMMANDS:
+            return f"[ERR] Batch exceeds {MAX_BATCH_COMMANDS} commands, nothing executed\n".encode('utf-8')
+        
+        started = time.monotonic()
+        results = []
+        real_conn = self.conn
+        self.in_batch = True
+        deferred_saves.collections = set()
+        try:
+            with lock:
+                for item in items:
+                    words = item[0].split(maxsplit=1)
+                    command = words[0].lower() if words else ''
+                    capture = OutputCapture(real_conn.origin)
+                    self.conn = capture
                     
-                    client_socket.send(f"AI: {response_text}\n".encode('utf-8'))
-                    logger.info(f"User '{current_user}' sent AI message")
+                    if command in BATCH_FORBIDDEN_COMMANDS:
+                        capture.send(f"[ERR] '{command}' is not allowed in batch\n".encode('utf-8'))
+                    else:
+                        try:
+                            self.handle_line(item[0])
+                            # Remaining lines are upload content; dropped if no upload started
+                            if self.upload:
+                                for line in item[1:]:
+                                    self.handle_line(line)
+                        except Exception as e:
+                            logger.error(f"Batch command '{item[0]}' failed: {e}")
+                            capture.send(b"[ERR] Internal error\n")
+                        if self.upload:
+                            self.upload = None
+                            capture.send(b"[ERR] Upload not terminated with END, discarded\n")
+                    
+                    results.append((item[0], capture.getvalue().decode('utf-8')))
+                
+                collections = deferred_saves.collections
+                deferred_saves.collections = None
+                if collections:
+                    save_data(*collections)
+        finally:
+            deferred_saves.collections = None
+            self.conn = real_conn
+            self.in_batch = False
+        
+        elapsed_ms = (time.monotonic() - started) * 1000
+        logger.info(f"User '{self.current_user}' ran batch of {len(items)} commands in {elapsed_ms:.1f} ms")
+        
+        if as_json:
+            return json.dumps([{'command': c, 'output': out} for c, out in results],
+                              ensure_ascii=False).encode('utf-8') + b'\n'
+        
+        out = []
+        for i, (command_line, output) in enumerate(results, 1):
+            out.append(f"[{i}] {command_line}\n{output}")
+        out.append(f"[OK] Batch: {len(results)} commands executed in {elapsed_ms:.1f} ms\n")
+        return ''.join(out).encode('utf-8')
+
+
+# Live connections of this process (for handoff and graceful shutdown)
+active_connections: set = set()
+active_connections_lock = threading.Lock()
+
+
+def handle_client(client_socket, addr, resume_state: Optional[dict] = None):
+    """Handle client connection; `resume_state` continues a connection adopted in a handoff"""
+    conn = Connection(client_socket, addr)
+    session = ClientSession(conn, addr)
+    handed_off = False
+    with active_connections_lock:
+        active_connections.add(conn)
+    
+    try:
+        if resume_state is None:
+            logger.info(f"Client connected: {addr}")
+            conn.send(b"Welcome! Type 'help' for commands\n\n")
+        else:
+            session.import_state(resume_state)
+            conn.inbuf += resume_state['inbuf'].encode('latin-1')
+            logger.info(f"Client adopted: {addr} ({session.current_user or 'not logged in'})")
+        
+        while True:
+            if session.current_user:
+                timeout = IDLE_TIMEOUT
+            else:
+                timeout = min(IDLE_TIMEOUT, session.login_deadline - time.monotonic())
             
-            elif command == 'quit' or command == 'exit':
-                client_socket.send(b"Goodbye!\n")
+            try:
+                line = conn.readline(timeout)
+            except socket.timeout:
+                reason = "Idle timeout" if session.current_user else "Login timeout"
+                logger.info(f"{reason} for {addr}")
+                conn.send(f"[ERR] {reason}, closing connection\n".encode('utf-8'))
+                break
+            except LineTooLongError as e:
+                logger.warning(f"Line too long from {addr}: {e}")
+                conn.send(f"[ERR] Line too long (max {MAX_LINE_LENGTH} bytes), closing connection\n".encode('utf-8'))
                 break
             
-            else:
-                client_socket.send(b"[ERR] Unknown command. Type 'help' for commands\n")
+            if line is None or not profiler.call(session.handle_line, line):
+                break
     
-    except ConnectionResetError:
+    except HandoffRequested:
+        handed_off = handoff.transfer(conn, session)
+    except (ConnectionResetError, BrokenPipeError):
         logger.warning(f"Connection reset by peer: {addr}")
+    except SlowClientError as e:
+        logger.warning(f"Disconnecting slow client {addr}: {e}")
     except Exception as e:
         logger.error(f"Error handling client {addr}: {e}")
     finally:
-        if session_id and session_id in sessions:
+        with active_connections_lock:
+            active_connections.discard(conn)
+        session.leave_channels()
+        if not handed_off and session.session_id:
+            # The session outlives the connection: the TTL restarts from the disconnect
             with lock:
-                del sessions[session_id]
-        client_socket.close()
+                if session.session_id in sessions:
+                    touch_session(session.session_id)
+        conn.close()
+        admission.release(addr[0])
+
+
+# ==========================================
+# ZERO-DOWNTIME RESTART
+# ==========================================
+# Set when this process should stop accepting (handoff or shutdown)
+stop_accepting = threading.Event()
+accept_stopped = threading.Event()
+
+
+def sd_notify(message: str):
+    """Send a state update to systemd; no-op unless started with Type=notify"""
+    path = os.environ.get('NOTIFY_SOCKET')
+    if not path:
+        return
+    if path.startswith('@'):
+        path = '\0' + path[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(path)
+            sock.sendall(message.encode('utf-8'))
+    except OSError as e:
+        logger.warning(f"sd_notify failed: {e}")
 
 
-def start_server():
-    """Start the server"""
+def inherited_listener() -> Optional[socket.socket]:
+    """
+    Listening socket passed in by a previous process (handoff) or by
+    systemd socket activation (serv_mess.socket), if any.
+    """
+    fd = os.environ.pop('SERV_MESS_LISTEN_FD', None)
+    if fd is not None:
+        return socket.socket(fileno=int(fd))
+    
+    if os.environ.get('LISTEN_PID') == str(os.getpid()) and int(os.environ.get('LISTEN_FDS', '0')) >= 1:
+        for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+            os.environ.pop(name, None)
+        return socket.socket(fileno=3)   # SD_LISTEN_FDS_START
+    
+    return None
+
+
+class Handoff:
+    """
+    Old-process side of a zero-downtime restart, started by SIGUSR2:
+      1. start a new process that inherits the listening socket,
+      2. once it has started up, stop accepting (new clients wait in the backlog),
+      3. pass every connection at its next command boundary, with its
+         session state, to the new process over a unix socket (SCM_RIGHTS),
+      4. flush data and hand over sessions, then exit.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listener = None
+        self.channel = None
+        self.states: Dict[str, dict] = {}
+        self.next_id = 0
+        self.done = threading.Event()
+        self.running = False
+
+    def request(self, signum=None, frame=None):
+        """SIGUSR2 handler"""
+        with self.lock:
+            if self.running:
+                logger.warning("[Handoff] Already in progress")
+                return
+            self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        proc = None
+        try:
+            if os.path.exists(HANDOFF_SOCKET):
+                os.unlink(HANDOFF_SOCKET)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            server.bind(HANDOFF_SOCKET)
+            server.listen(1)
+            server.settimeout(HANDOFF_START_TIMEOUT)
+            
+            env = dict(os.environ, SERV_MESS_LISTEN_FD=str(self.listener.fileno()))
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--takeover'],
+                                    pass_fds=(self.listener.fileno(),), env=env)
+            logger.info(f"[Handoff] Started new process {proc.pid}, waiting for it to start up")
+            
+            self.channel, _ = server.accept()
+            server.close()
+            os.unlink(HANDOFF_SOCKET)
+            self.channel.settimeout(HANDOFF_START_TIMEOUT)
+            if self.channel.recv(64) != b'ready':
+                raise RuntimeError("new process did not report ready")
+        except Exception as e:
+            logger.error(f"[Handoff] Aborted, continuing to serve: {e}")
+            if proc is not None:
+                proc.kill()
+            with self.lock:
+                self.running = False
+            return
+        
+        # From here on the new process owns the listener
+        stop_accepting.set()
+        accept_stopped.wait()
+        handoff_event.set()
+        logger.info("[Handoff] New process ready, transferring connections")
+        
+        # admission.total also counts connections whose thread has not started yet
+        deadline = time.monotonic() + HANDOFF_DRAIN_TIMEOUT
+        while admission.total and time.monotonic() < deadline:
+            time.sleep(0.05)
+        
+        with active_connections_lock:
+            stuck = list(active_connections)
+        for conn in stuck:
+            logger.warning(f"[Handoff] Closing {conn.addr}: still busy after {HANDOFF_DRAIN_TIMEOUT}s")
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if stuck:
+            time.sleep(1)
+        
+        try:
+            with lock:
+                save_data()
+                with open(HANDOFF_STATE_FILE, 'w') as f:
+                    json.dump({'sessions': sessions.to_dict(), 'connections': self.states}, f)
+                # Before we exit: otherwise systemd sees the main PID die and stops the service
+                sd_notify(f"MAINPID={proc.pid}")
+                self.channel.send(b'done')
+            logger.info(f"[Handoff] Complete: {len(self.states)} connections transferred, exiting")
+        except Exception as e:
+            logger.error(f"[Handoff] Failed to hand over state: {e}")
+        finally:
+            self.done.set()
+
+    def transfer(self, conn, session) -> bool:
+        """Pass a connection to the new process. Called from the connection's thread."""
+        try:
+            conn.flush()
+            state = session.export_state()
+            state['inbuf'] = conn.inbuf.decode('latin-1')
+            with self.lock:
+                conn_id = str(self.next_id)
+                self.next_id += 1
+                self.states[conn_id] = state
+                socket.send_fds(self.channel, [f"conn {conn_id}".encode('utf-8')], [conn.sock.fileno()])
+            return True
+        except Exception as e:
+            logger.error(f"[Handoff] Failed to transfer {conn.addr}: {e}")
+            return False
+
+handoff = Handoff()
+
+
+def take_over(listener):
+    """
+    New-process side of a handoff: report ready, collect the connections,
+    then load the flushed data and the sessions and resume serving them.
+    """
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    channel.connect(HANDOFF_SOCKET)
+    channel.send(b'ready')
+    
+    fds: Dict[str, int] = {}
+    while True:
+        msg, received, _, _ = socket.recv_fds(channel, 1024, 1)
+        if not msg or msg == b'done':
+            break
+        fds[msg.decode('utf-8').split()[1]] = received[0]
+    channel.close()
+    
     load_data()
+    with open(HANDOFF_STATE_FILE, 'r') as f:
+        state = json.load(f)
+    os.unlink(HANDOFF_STATE_FILE)
+    with lock:
+        sessions.load(state['sessions'])
+    
+    for conn_id, fd in fds.items():
+        client_socket = socket.socket(fileno=fd)
+        try:
+            addr = client_socket.getpeername()
+        except OSError:
+            client_socket.close()
+            continue
+        admission.acquire(addr[0], force=True)
+        thread = threading.Thread(target=handle_client,
+                                  args=(client_socket, addr, state['connections'].get(conn_id)))
+        thread.daemon = True
+        thread.start()
     
+    logger.info(f"[Handoff] Took over {len(fds)} connections and {len(state['sessions'])} sessions")
+
+
+def shutdown_gracefully():
+    """Stop: tell connected clients and flush data"""
+    with active_connections_lock:
+        conns = list(active_connections)
+    for conn in conns:
+        try:
+            conn.sock.settimeout(1)
+            conn.sock.sendall(b"[INFO] Server is shutting down\n")
+        except OSError:
+            pass
+    with lock:
+        save_data()
+    logger.info(f"Server stopped, data saved ({len(conns)} clients disconnected)")
+
+
+def create_server_socket(reuse_port=False):
+    """Create the listening TCP socket"""
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Every worker binds its own socket; the kernel balances connections
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server.bind((HOST, PORT))
-    server.listen(5)
+    server.listen(128)
+    return server
+
+
+def serve_forever(server):
+    """Accept clients, one thread per connection, until stop_accepting is set"""
+    server.settimeout(READ_POLL_INTERVAL)
+    try:
+        while not stop_accepting.is_set():
+            try:
+                client_socket, addr = server.accept()
+            except socket.timeout:
+                continue
+            reason = admission.acquire(addr[0])
+            if reason:
+                reject_client(client_socket, addr, reason)
+                continue
+            thread = threading.Thread(target=handle_client, args=(client_socket, addr))
+            thread.daemon = True
+            thread.start()
+    except KeyboardInterrupt:
+        logger.info("Server stopped by user")
+    finally:
+        server.close()
+        accept_stopped.set()
+
+
+def start_server(takeover=False):
+    """Start the server (`takeover`: continue from a process handing off to us)"""
+    server = inherited_listener() or create_server_socket()
+    
+    if takeover:
+        take_over(server)
+    else:
+        load_data()
+    reload_rate_limits()
+    start_sweepers()
+    signal.signal(signal.SIGHUP, reload_rate_limits)
+    signal.signal(signal.SIGUSR1, dump_diagnostics)
+    signal.signal(signal.SIGUSR2, handoff.request)
+    # systemd stops the service with SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    handoff.listener = server
+    sd_notify(f"MAINPID={os.getpid()}\nREADY=1")
     
     logger.info(f"Server started on {HOST}:{PORT}")
     logger.info(f"Clients can connect with: nc {HOST} {PORT}")
     
+    try:
+        serve_forever(server)
+        if stop_accepting.is_set():
+            # Stopped accepting for a handoff: keep serving until connections are transferred
+            handoff.done.wait()
+    finally:
+        if not handoff.done.is_set():
+            shutdown_gracefully()
+
+
+def run_worker(worker_id: int):
+    """Worker process: state comes from the coordinator, not from data files"""
+    global persist_data
+    persist_data = False
+    
+    notification_bus.connect(BUS_SOCKET)
+    reload_rate_limits()
+    start_sweepers()
+    signal.signal(signal.SIGHUP, reload_rate_limits)
+    signal.signal(signal.SIGUSR1, dump_diagnostics)
+    server = create_server_socket(reuse_port=True)
+    
+    logger.info(f"Worker {worker_id} (pid {os.getpid()}) listening on {HOST}:{PORT}")
+    serve_forever(server)
+
+
+def start_coordinator(num_workers: int):
+    """
+    Multi-worker mode: this process owns the data files and the bus,
+    and supervises `num_workers` worker processes sharing the port.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        logger.error("SO_REUSEPORT is not supported on this platform")
+        sys.exit(1)
+    
+    load_data()
+    reload_rate_limits()
+    hub = BusHub(BUS_SOCKET)
+    hub.start()
+    start_sweepers()
+    
+    def spawn(worker_id):
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker-id', str(worker_id)]
+        return subprocess.Popen(cmd)
+    
+    workers = {i: spawn(i) for i in range(num_workers)}
+    
+    def forward_signal(signum, frame):
+        for proc in workers.values():
+            proc.send_signal(signum)
+    
+    # systemd stops the service with SIGTERM: shut the workers down and flush
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    def reload_everywhere(signum, frame):
+        # The coordinator keeps the buckets; workers use the limits to skip unlimited commands
+        reload_rate_limits()
+        forward_signal(signum, frame)
+    
+    signal.signal(signal.SIGHUP, reload_everywhere)
+    # Diagnostics are per process: pass them on to the workers
+    signal.signal(signal.SIGUSR1, forward_signal)
+    signal.signal(signal.SIGUSR2, lambda signum, frame: logger.warning(
+        "Zero-downtime handoff is only supported in single-process mode"))
+    logger.info(f"Coordinator started {num_workers} workers on {HOST}:{PORT}")
+    logger.info(f"Clients can connect with: nc {HOST} {PORT}")
+    
     try:
         while True:
-            client_socket, addr = server.accept()
-            thread = threading.Thread(target=handle_client, args=(client_socket, addr))
-            thread.daemon = True
-            thread.start()
+            time.sleep(WORKER_RESPAWN_DELAY)
+            for worker_id, proc in workers.items():
+                if proc.poll() is not None:
+                    logger.warning(f"Worker {worker_id} exited with code {proc.returncode}, restarting")
+                    workers[worker_id] = spawn(worker_id)
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
     finally:
-        server.close()
+        for proc in workers.values():
+            proc.terminate()
+        for proc in workers.values():
+            proc.wait()
+        with lock:
+            save_data()
+        os.unlink(BUS_SOCKET)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Message server with chat, tasks and AI")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes sharing the port (default: 1, single process)")
+    parser.add_argument('--worker-id', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--takeover', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--measure-memory', type=int, metavar='N', default=None,
+                        help="print memory used by N chat messages/tasks as dicts vs records, then exit")
+    parser.add_argument('--check-data', action='store_true',
+                        help="check that loading and saving the data files reproduces them exactly, then exit")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    start_server()
+    args = parse_args()
+    if args.measure_memory:
+        measure_record_memory(args.measure_memory)
+    elif args.check_data:
+        sys.exit(0 if check_data_roundtrip() else 1)
+    elif args.worker_id is not None:
+        run_worker(args.worker_id)
+    elif args.workers > 1:
+        start_coordinator(args.workers)
+    else:
+        start_server(takeover=args.takeover)